@@ -0,0 +1,514 @@
+#!/usr/bin/env python
+# encoding: utf8
+#
+# Benchmarks of the hot paths of the font build.
+#
+# Benchmarks run on fixtures made from src/Inter-Roman.glyphspackage the same way the
+# Makefile makes designspaces, UFOs and variable fonts, except that only the glyphs
+# listed in misc/bench/glyphs.txt (and their components) keep their outlines. Fixtures
+# are stored in build/bench/fixtures, named after a hash of everything they are made
+# from, and are only made when missing.
+#
+# Results are written as JSON. Two results can be compared, failing (exit status 1) when
+# any benchmark got slower by more than a threshold. Examples:
+#
+#   misc/bench/bench.py run -o build/bench/before.json
+#   misc/bench/bench.py run -o build/bench/after.json buildStatic.otf subset_range
+#   misc/bench/bench.py compare build/bench/before.json build/bench/after.json
+#
+# With --root, the benchmarks run the code of another checkout of this repository (on
+# the same fixtures.) This is how CI compares a pull request with its base.
+#
+import os, sys, json, time, runpy, shutil, hashlib, argparse, platform, tempfile
+import logging, subprocess, statistics, importlib.util
+from contextlib import contextmanager, redirect_stdout
+from os.path import dirname, basename, abspath, relpath, isdir, join as pjoin
+
+BENCHDIR = dirname(abspath(__file__))
+BASEDIR = abspath(pjoin(BENCHDIR, os.pardir, os.pardir))
+
+SOURCE_FILE = pjoin(BASEDIR, 'src', 'Inter-Roman.glyphspackage')
+FEATURES_DIR = pjoin(BASEDIR, 'src', 'features')
+GLYPHS_FILE = pjoin(BENCHDIR, 'glyphs.txt')
+FIXTURES_DIR = pjoin(BASEDIR, 'build', 'bench', 'fixtures')
+
+# Bump this when changing how fixtures are made
+FIXTURES_VERSION = 1
+
+RESULTS_VERSION = 1
+
+DEFAULT_THRESHOLD = 15  # percent
+
+# UFO compiled by the buildStatic benchmarks
+STATIC_UFO = 'Inter-Regular.ufo'
+
+# unicode-range of the "latin" subset of the web fonts
+LATIN_UNICODE_RANGE = ','.join([
+  'U+0000-00FF', 'U+0131', 'U+0152-0153', 'U+02BB-02BC', 'U+02C6', 'U+02DA', 'U+02DC',
+  'U+2000-206F', 'U+2074', 'U+20AC', 'U+2122', 'U+2191', 'U+2193', 'U+2212', 'U+2215',
+  'U+FEFF', 'U+FFFD',
+])
+
+# tools whose versions are recorded with results
+TOOLS = [
+  'fonttools', 'ufo2ft', 'fontmake', 'glyphsLib', 'defcon', 'skia-pathops', 'brotli',
+  'numpy',
+]
+
+ROOT = BASEDIR  # checkout of the code being benchmarked (--root)
+
+
+# ---------------------------------------------------------------------------------
+# benchmarks
+
+BENCHMARKS = []  # [(name, function)]
+
+
+def benchmark(name):
+  def register(fn):
+    BENCHMARKS.append((name, fn))
+    return fn
+  return register
+
+
+@benchmark('buildStatic.otf')
+def bench_buildStatic_otf(ctx):
+  from fontbuildlib import FontBuilder
+  with ctx.timed():
+    FontBuilder().buildStatic(ctx.fixture(STATIC_UFO), ctx.tmp('out.otf'), cff=True)
+
+
+@benchmark('buildStatic.ttf')
+def bench_buildStatic_ttf(ctx):
+  from fontbuildlib import FontBuilder
+  with ctx.timed():
+    FontBuilder().buildStatic(ctx.fixture(STATIC_UFO), ctx.tmp('out.ttf'), cff=False)
+
+
+@benchmark('buildVariable')
+def bench_buildVariable(ctx):
+  from fontbuildlib import FontBuilder
+  with ctx.timed():
+    FontBuilder().buildVariable(
+      ctx.fixture('Inter-Roman.var.designspace'), ctx.tmp('out.ttf'))
+
+
+@benchmark('update_sources')
+def bench_update_sources(ctx):
+  # postprocess-designspace.py, which modifies the designspace's UFOs
+  from fontTools.designspaceLib import DesignSpaceDocument
+  fixtures = ctx.copyFixtures()
+  script = loadScript('postprocess-designspace.py')
+  designspace = DesignSpaceDocument.fromfile(pjoin(fixtures, 'Inter-Roman.designspace'))
+  with ctx.timed():
+    script.update_sources(designspace)
+
+
+@benchmark('decomposeGlyphs')
+def bench_decomposeGlyphs(ctx):
+  # decomposes all composite glyphs of all masters
+  from defcon import Font
+  from fontTools.designspaceLib import DesignSpaceDocument
+  from fontbuildlib.glyph import decomposeGlyphs
+  designspace = DesignSpaceDocument.fromfile(ctx.fixture('Inter-Roman.designspace'))
+  masters = [Font(path) for path in sorted(set(s.path for s in designspace.sources))]
+  glyphNames = set()
+  for ufo in masters:
+    glyphNames.update(g.name for g in ufo if g.components)
+  with ctx.timed():
+    decomposeGlyphs(masters, glyphNames)
+
+
+@benchmark('subset_range')
+def bench_subset_range(ctx):
+  # subset.py; the "latin" web font subset of the variable font
+  import subset
+  with ctx.timed():
+    subset.subset_range(
+      ctx.fixture('Inter-Roman.var.ttf'), ctx.tmp('out.woff2'), LATIN_UNICODE_RANGE)
+
+
+@benchmark('woff2')
+def bench_woff2(ctx):
+  with ctx.timed():
+    runScript('woff2', ['compress', '-q', '-o', ctx.tmp('out.woff2'),
+                        ctx.fixture('Inter-Roman.var.ttf')])
+
+
+@benchmark('bake-vf')
+def bench_bake_vf(ctx):
+  with ctx.timed():
+    runScript('bake-vf.py', [ctx.fixture('Inter-Roman.var.ttf'), '-o', ctx.tmp('out.ttf')])
+
+
+class Context:
+  # Passed to benchmark functions. Each run of a benchmark gets a new Context.
+
+  def __init__(self, fixtures, tmpdir):
+    self.fixtures = fixtures
+    self.tmpdir = tmpdir
+    self.elapsed = None
+
+
+  def fixture(self, name):
+    # path of a fixture file. Must not be modified; see copyFixtures
+    return pjoin(self.fixtures, name)
+
+
+  def copyFixtures(self):
+    # copies all fixtures to a temporary directory and returns its path
+    dst = self.tmp('fixtures')
+    shutil.copytree(self.fixtures, dst, symlinks=True)
+    return dst
+
+
+  def tmp(self, name):
+    # path of a temporary file
+    return pjoin(self.tmpdir, name)
+
+
+  @contextmanager
+  def timed(self):
+    # times the code measured by a benchmark. Everything else is setup.
+    start = time.perf_counter()
+    yield
+    self.elapsed = time.perf_counter() - start
+
+
+def loadScript(name):
+  # imports a script in misc/tools of ROOT as a module. The module is registered in
+  # sys.modules (as e.g. "postprocess_designspace") so that its functions can be
+  # passed to worker processes.
+  modname = os.path.splitext(name)[0].replace('-', '_')
+  module = sys.modules.get(modname)
+  if module is None:
+    spec = importlib.util.spec_from_file_location(
+      modname, pjoin(ROOT, 'misc', 'tools', name))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[modname] = module
+    spec.loader.exec_module(module)
+  return module
+
+
+def runScript(name, args):
+  # runs a script in misc/tools of ROOT in this process, as if it was run with args
+  path = pjoin(ROOT, 'misc', 'tools', name)
+  argv = sys.argv
+  sys.argv = [path] + args
+  try:
+    runpy.run_path(path, run_name='__main__')
+  except SystemExit as e:
+    if e.code not in (None, 0):
+      raise Exception('%s exited with status %r' % (name, e.code))
+  finally:
+    sys.argv = argv
+
+
+def runBenchmark(fn, fixtures, repeat):
+  # runs fn repeat times and returns the time of each run
+  times = []
+  for _ in range(repeat):
+    tmpdir = tempfile.mkdtemp(prefix='inter-bench-')
+    try:
+      ctx = Context(fixtures, tmpdir)
+      with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        fn(ctx)
+      if ctx.elapsed is None:
+        raise Exception('benchmark did not call ctx.timed()')
+      times.append(ctx.elapsed)
+    finally:
+      shutil.rmtree(tmpdir, ignore_errors=True)
+  return times
+
+
+# ---------------------------------------------------------------------------------
+# fixtures
+
+def fixturesKey():
+  # hash of everything fixtures are made from
+  h = hashlib.sha1(repr(FIXTURES_VERSION).encode('utf-8'))
+  inputs = [SOURCE_FILE, FEATURES_DIR, GLYPHS_FILE,
+            pjoin(BASEDIR, 'misc', 'tools', 'gen-var-designspace.py')]
+  for path in inputs:
+    for filename in sorted(listFiles(path)):
+      h.update(relpath(filename, BASEDIR).encode('utf-8'))
+      with open(filename, 'rb') as f:
+        h.update(f.read())
+  for name in ('glyphsLib', 'fontmake'):
+    h.update(repr(toolVersion(name)).encode('utf-8'))
+  return h.hexdigest()[:16]
+
+
+def listFiles(path):
+  if not isdir(path):
+    return [path]
+  files = []
+  for dirpath, dirnames, filenames in os.walk(path):
+    files += [pjoin(dirpath, filename) for filename in filenames]
+  return files
+
+
+def readGlyphNames(filename):
+  names = []
+  with open(filename, 'r', encoding='utf-8') as f:
+    for line in f:
+      names += line.split('#', 1)[0].split()
+  return names
+
+
+def fixtures(force=False):
+  # Returns the directory of fixtures, making them if needed
+  fixturesdir = pjoin(FIXTURES_DIR, fixturesKey())
+  if isdir(fixturesdir) and not force:
+    return fixturesdir
+  print('making fixtures %s' % relpath(fixturesdir, os.getcwd()), file=sys.stderr)
+  tmpdir = fixturesdir + '.tmp'
+  shutil.rmtree(tmpdir, ignore_errors=True)
+  os.makedirs(tmpdir)
+  fm_args = ['--verbose', 'WARNING']
+
+  # like $(UFODIR)/%.glyphs, $(UFODIR)/%.designspace & $(UFODIR)/%.var.designspace
+  run(['glyphspkg', '-o', tmpdir, SOURCE_FILE])
+  shutil.copytree(FEATURES_DIR, pjoin(tmpdir, 'features'))
+  glyphsfile = pjoin(tmpdir, 'Inter-Roman.glyphs')
+  designspace = pjoin(tmpdir, 'Inter-Roman.designspace')
+  run([sys.executable, '-m', 'fontmake'] + fm_args + [
+    '-o', 'ufo', '-g', glyphsfile, '--designspace-path', designspace,
+    '--master-dir', tmpdir, '--instance-dir', pjoin(tmpdir, 'instances')])
+  os.unlink(glyphsfile)
+  stubGlyphs(designspace, readGlyphNames(GLYPHS_FILE))
+  vardesignspace = pjoin(tmpdir, 'Inter-Roman.var.designspace')
+  run([sys.executable, pjoin(BASEDIR, 'misc', 'tools', 'gen-var-designspace.py'),
+       designspace, vardesignspace])
+
+  # like $(FONTDIR)/var/.%.var.ttf
+  run([sys.executable, '-m', 'fontmake'] + fm_args + [
+    '-o', 'variable', '-m', vardesignspace,
+    '--output-path', pjoin(tmpdir, 'Inter-Roman.var.ttf'),
+    '--overlaps-backend', 'pathops', '--flatten-components', '--no-autohint',
+    '--production-names'])
+
+  shutil.rmtree(fixturesdir, ignore_errors=True)
+  os.rename(tmpdir, fixturesdir)
+  return fixturesdir
+
+
+def stubGlyphs(designspacePath, glyphNames):
+  # Removes outlines of all glyphs of the designspace's UFOs except glyphNames and the
+  # glyphs they are made of
+  from defcon import Font
+  from fontTools.designspaceLib import DesignSpaceDocument
+  designspace = DesignSpaceDocument.fromfile(designspacePath)
+  for path in sorted(set(s.path for s in designspace.sources)):
+    ufo = Font(path)
+    missing = [name for name in glyphNames if name not in ufo]
+    if missing:
+      raise Exception('glyphs listed in %s not found in %s: %s' % (
+        relpath(GLYPHS_FILE, os.getcwd()), basename(path), ' '.join(missing)))
+    for layer in ufo.layers:
+      keep = set()
+      stack = [name for name in glyphNames if name in layer]
+      while stack:
+        name = stack.pop()
+        if name not in keep and name in layer:
+          keep.add(name)
+          stack += [c.baseGlyph for c in layer[name].components]
+      for g in layer:
+        if g.name not in keep:
+          g.clearContours()
+          g.clearComponents()
+    ufo.save(path)
+
+
+def run(args):
+  p = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                     encoding='utf-8')
+  if p.returncode != 0:
+    raise Exception('%s failed:\n%s' % (' '.join(args), p.stdout.strip()))
+
+
+# ---------------------------------------------------------------------------------
+# results
+
+def toolVersion(name):
+  try:
+    from importlib.metadata import version
+    return version(name)
+  except Exception:
+    return None
+
+
+def gitHash(root):
+  try:
+    return subprocess.check_output(
+      ['git', '-C', root, 'rev-parse', '--short', 'HEAD'],
+      stderr=subprocess.DEVNULL, encoding='utf-8').strip()
+  except Exception:
+    return None
+
+
+def compare(baseline, results, threshold):
+  # Returns (table, regressions) where regressions is a list of benchmark names which
+  # are more than threshold percent slower in results than in baseline
+  if baseline.get('fixtures') != results.get('fixtures'):
+    print('warning: results were made with different fixtures', file=sys.stderr)
+  if baseline.get('environment') != results.get('environment'):
+    print('warning: results were made in different environments', file=sys.stderr)
+  rows = [('benchmark', 'baseline', 'result', 'change', '')]
+  regressions = []
+  base = baseline['benchmarks']
+  for name, r in results['benchmarks'].items():
+    b = base.get(name)
+    if b is None:
+      rows.append((name, '', '%.3fs' % r['min'], 'new', ''))
+      continue
+    change = 100.0 * (r['min'] - b['min']) / b['min']
+    flag = ''
+    if change > threshold:
+      flag = 'REGRESSION'
+      regressions.append(name)
+    rows.append((name, '%.3fs' % b['min'], '%.3fs' % r['min'], '%+.1f%%' % change, flag))
+  for name, b in base.items():
+    if name not in results['benchmarks']:
+      rows.append((name, '%.3fs' % b['min'], '', 'removed', ''))
+  widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+  lines = []
+  for row in rows:
+    cols = [row[0].ljust(widths[0])] + [c.rjust(w) for c, w in zip(row[1:4], widths[1:4])]
+    lines.append(('  '.join(cols) + '  ' + row[4]).rstrip())
+  return '\n'.join(lines), regressions
+
+
+def loadResults(filename):
+  with open(filename, 'r', encoding='utf-8') as f:
+    results = json.load(f)
+  if results.get('version') != RESULTS_VERSION:
+    raise Exception('%s: unsupported results version %r' % (filename, results.get('version')))
+  return results
+
+
+# ---------------------------------------------------------------------------------
+# commands
+
+def cmd_run(args):
+  global ROOT
+  ROOT = abspath(args.root)
+  # import code being benchmarked from ROOT
+  sys.path[:0] = [pjoin(ROOT, 'misc'), pjoin(ROOT, 'misc', 'tools')]
+  logging.basicConfig(level=logging.WARNING, format='%(message)s')
+
+  benchmarks = BENCHMARKS
+  if args.benchmarks:
+    names = [name for name, _ in BENCHMARKS]
+    for name in args.benchmarks:
+      if name not in names:
+        raise SystemExit('unknown benchmark %r (see "%s list")' % (name, sys.argv[0]))
+    benchmarks = [(name, fn) for name, fn in BENCHMARKS if name in args.benchmarks]
+
+  baseline = None
+  if args.baseline:
+    baseline = loadResults(args.baseline)  # before running; fail early
+
+  fixturesdir = fixtures()
+  results = {
+    'version': RESULTS_VERSION,
+    'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    'git': gitHash(ROOT),
+    'fixtures': basename(fixturesdir),
+    'repeat': args.repeat,
+    'environment': {
+      'python': platform.python_version(),
+      'platform': platform.platform(),
+      'cpus': os.cpu_count(),
+      'tools': {name: toolVersion(name) for name in TOOLS},
+    },
+    'benchmarks': {},
+  }
+  for name, fn in benchmarks:
+    times = runBenchmark(fn, fixturesdir, args.repeat)
+    results['benchmarks'][name] = {
+      'min': min(times),
+      'median': statistics.median(times),
+      'times': times,
+    }
+    print('%-20s %8.3fs  (median %.3fs)' % (name, min(times), statistics.median(times)))
+
+  if args.output:
+    os.makedirs(dirname(abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+      json.dump(results, f, indent=2)
+      f.write('\n')
+    print('write %s' % args.output)
+
+  if baseline is not None:
+    return compareAndReport(baseline, results, args.threshold)
+  return 0
+
+
+def cmd_compare(args):
+  return compareAndReport(
+    loadResults(args.baseline), loadResults(args.results), args.threshold)
+
+
+def compareAndReport(baseline, results, threshold):
+  table, regressions = compare(baseline, results, threshold)
+  print(table)
+  if regressions:
+    print('%d benchmark%s slower than baseline by more than %g%%: %s' % (
+      len(regressions), '' if len(regressions) == 1 else 's', threshold,
+      ', '.join(regressions)), file=sys.stderr)
+    return 1
+  return 0
+
+
+def cmd_fixtures(args):
+  print(fixtures(force=args.force))
+  return 0
+
+
+def cmd_list(args):
+  for name, _ in BENCHMARKS:
+    print(name)
+  return 0
+
+
+def main():
+  argparser = argparse.ArgumentParser(description='Benchmarks of the font build')
+  commands = argparser.add_subparsers(dest='command', metavar='<command>')
+  commands.required = True
+
+  p = commands.add_parser('run', help='Run benchmarks')
+  p.set_defaults(fn=cmd_run)
+  p.add_argument('benchmarks', metavar='<benchmark>', nargs='*',
+    help='Benchmarks to run. Defaults to all (see "list")')
+  p.add_argument('-o', '--output', metavar='<file>',
+    help='Write results to <file> as JSON')
+  p.add_argument('-n', '--repeat', metavar='<N>', type=int, default=3,
+    help='Run each benchmark <N> times (default: %(default)s)')
+  p.add_argument('--root', metavar='<dir>', default=BASEDIR,
+    help='Benchmark the code of another checkout of the repository at <dir>')
+  p.add_argument('--baseline', metavar='<file>',
+    help='Compare with results in <file> and fail on regressions')
+  p.add_argument('--threshold', metavar='<percent>', type=float, default=DEFAULT_THRESHOLD,
+    help='Max slowdown compared to --baseline (default: %(default)s%%)')
+
+  p = commands.add_parser('compare', help='Compare results, failing on regressions')
+  p.set_defaults(fn=cmd_compare)
+  p.add_argument('baseline', metavar='<baseline>', help='Results to compare with')
+  p.add_argument('results', metavar='<results>', help='Results to check')
+  p.add_argument('--threshold', metavar='<percent>', type=float, default=DEFAULT_THRESHOLD,
+    help='Max slowdown of any benchmark (default: %(default)s%%)')
+
+  p = commands.add_parser('fixtures', help='Make fixtures and print their directory')
+  p.set_defaults(fn=cmd_fixtures)
+  p.add_argument('--force', action='store_true', help='Remake fixtures')
+
+  p = commands.add_parser('list', help='List benchmarks')
+  p.set_defaults(fn=cmd_list)
+
+  args = argparser.parse_args()
+  sys.exit(args.fn(args))
+
+
+if __name__ == '__main__':
+  main()
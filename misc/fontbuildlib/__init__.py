@@ -1 +1,16 @@
-from .builder import FontBuilder
+import sys
+from os.path import abspath, dirname, join as pjoin
+
+# fontbuildlib uses modules of misc/tools (common, postprocess_instance_ufo)
+_TOOLSDIR = abspath(pjoin(dirname(__file__), '..', 'tools'))
+if _TOOLSDIR not in sys.path:
+  sys.path.append(_TOOLSDIR)
+
+# FontBuilder is imported on first use, so that tools which only need a small module
+# like fontbuildlib.glif don't import the builder, ufo2ft and the caches.
+
+def __getattr__(name):
+  if name == 'FontBuilder':
+    from .builder import FontBuilder
+    return FontBuilder
+  raise AttributeError('module %r has no attribute %r' % (__name__, name))
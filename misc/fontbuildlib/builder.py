@@ -1,19 +1,36 @@
+import os
 import logging
 import ufo2ft
-from defcon import Font
+from multiprocessing import Pool
+from os.path import basename, splitext, join as pjoin
 from ufo2ft.util import _LazyFontName
-from ufo2ft.filters.removeOverlaps import RemoveOverlapsFilter
+from ufo2ft.filters.decomposeComponents import DecomposeComponentsFilter
+from ufo2ft.filters.skipExportGlyphs import SkipExportGlyphsFilter
+from ufo2ft.outlineCompiler import OutlineOTFCompiler, OutlineTTFCompiler
+from ufo2ft.postProcessor import PostProcessor
+from ufo2ft.preProcessor import OTFInterpolatablePreProcessor, TTFInterpolatablePreProcessor
 from fontTools.designspaceLib import DesignSpaceDocument
 from .name import getFamilyName, setFullName
 from .info import updateFontVersion
 from .glyph import findGlyphDirectives, composedGlyphIsTrivial, decomposeGlyphs
+from .glif import GlifReader
 from .stat import rebuildStatTable
+from .overlaps import CachedRemoveOverlapsFilter, removeOverlaps
+from .features import cachedFeatureCompilerClass
+from .server import loadFont
+from . import timing
 
 log = logging.getLogger(__name__)
 
 
 class FontBuilder:
-  # def __init__(self, *args, **kwargs)
+
+  def __init__(self,
+    overlapCache=None,  # OverlapCache to use for overlap removal, or None
+    featureCache=None,  # FeatureCache to use for feature compilation, or None
+  ):
+    self.overlapCache = overlapCache
+    self.featureCache = featureCache
 
   def buildStatic(self,
     ufo,             # input UFO as filename string or defcon.Font object
@@ -21,38 +38,161 @@ class FontBuilder:
     cff=True,        # true = makes CFF outlines. false = makes TTF outlines.
     **kwargs,        # passed along to ufo2ft.compile*()
   ):
-    if isinstance(ufo, str):
-      ufo = Font(ufo)
-
-    # update version to actual, real version. Must come after any call to setFontInfo.
-    updateFontVersion(ufo, dummy=False, isVF=False)
-
-    # decompose some glyphs
-    glyphNamesToDecompose = set()
-    componentReferences = set(ufo.componentReferences)
-    for g in ufo:
-      directives = findGlyphDirectives(g.note)
-      if self._shouldDecomposeGlyph(g, directives, componentReferences):
-        glyphNamesToDecompose.add(g.name)
+    with timing.build(basename(outputFilename), 'compile'):
+      if isinstance(ufo, str):
+        with timing.stage('load UFO'):
+          ufo = loadFont(ufo)
+      self._prepareStatic(ufo)
+      self._compileStatics(ufo, [(outputFilename, cff)], **kwargs)
+
+
+  def buildStatics(self,
+    ufos,                     # input UFO filenames
+    outdir,                   # directory to write font files to
+    formats=('otf', 'ttf'),   # font formats to produce for each UFO
+    jobs=None,                # max number of processes to use. None = number of CPUs
+    onFile=None,              # optional function called with filename of each font file
+    productionNames=True,     # rename glyphs to their production names
+  ):
+    # Compiles many UFOs in a pool of worker processes, using buildStaticFormats.
+    # Each UFO is loaded once and all formats are produced from it.
+    # Font files are named after the UFOs, e.g. "outdir/Inter-Bold.otf".
+    # Returns the list of filenames of all font files produced.
+    for format in formats:
+      if format not in ('otf', 'ttf'):
+        raise ValueError('invalid font format %r (expected "otf" or "ttf")' % format)
+    tasks = [(ufo, outdir, tuple(formats), productionNames,
+              self.overlapCache, self.featureCache)
+             for ufo in ufos]
+    if jobs is None:
+      jobs = os.cpu_count() or 1
+    jobs = min(jobs, len(tasks))
+    filenames = []
+    def addResult(outputFilenames):
+      for filename in outputFilenames:
+        filenames.append(filename)
+        if onFile is not None:
+          onFile(filename)
+    if jobs < 2:
+      for task in tasks:
+        addResult(_buildStaticsProc(task))
+    else:
+      with Pool(jobs) as pool:
+        for outputFilenames in pool.imap_unordered(_buildStaticsProc, tasks):
+          addResult(outputFilenames)
+    return filenames
+
+
+  def _prepareStatic(self, ufo):
+    with timing.stage('preprocess glyphs'):
+      # update version to actual, real version. Must come after any call to setFontInfo.
+      updateFontVersion(ufo, dummy=False, isVF=False)
+
+      # find glyphs to decompose
+      glyphNamesToDecompose = set()
+      componentReferences = set(ufo.componentReferences)
+      for g in ufo:
+        directives = findGlyphDirectives(g.note)
+        if self._shouldDecomposeGlyph(g, directives, componentReferences):
+          glyphNamesToDecompose.add(g.name)
     self._decompose([ufo], glyphNamesToDecompose)
 
+
+  def buildStaticFormats(self,
+    ufo,                   # input UFO as filename string or defcon.Font object
+    outputFilenames,       # output filename strings; format is decided by extension
+    productionNames=True,  # rename glyphs to their production names
+  ):
+    # Compiles ufo into several font files, e.g. ["Inter-Bold.otf", "Inter-Bold.ttf"],
+    # from a single load of the UFO.
+    #
+    # The result is the same as that of running, for each format,
+    #   fontmake -u <ufo> -o otf|ttf --overlaps-backend pathops --flatten-components
+    # which is how the release static fonts used to be built. So unlike buildStatic,
+    # the version of the UFO is used as-is and glyph directives are not applied.
+    formats = []
+    for outputFilename in outputFilenames:
+      ext = splitext(outputFilename)[1].lower()
+      if ext not in ('.otf', '.ttf'):
+        raise ValueError('invalid file format %r (expected ".otf" or ".ttf")' % ext)
+      formats.append((outputFilename, ext == '.otf'))
+    if len(formats) == 0:
+      return
+    with timing.build(splitext(basename(outputFilenames[0]))[0], 'compile'):
+      if isinstance(ufo, str):
+        with timing.stage('load UFO'):
+          ufo = loadFont(ufo)
+      self._compileStatics(ufo, formats,
+                           useProductionNames=productionNames,
+                           flattenComponents=True)
+
+
+  def _compileStatics(self, ufo, formats, **kwargs):
+    # formats is a list of (outputFilename, cff).
+    # OTFs are compiled first, from ufo as is: ufo2ft decomposes all components before
+    # removing overlaps, and removing overlaps in the component glyphs beforehand would
+    # change the resulting outlines. For TTFs, overlaps are then removed once, in ufo,
+    # the same way ufo2ft would (see _removeOverlapsTTF.)
+    # The last font compiled may consume ufo.
+    otfs = [filename for filename, cff in formats if cff]
+    ttfs = [filename for filename, cff in formats if not cff]
+    for i, outputFilename in enumerate(otfs):
+      inplace = (i == len(otfs) - 1 and len(ttfs) == 0)
+      self._compileStatic(ufo, outputFilename, True, inplace, **kwargs)
+    if len(ttfs) > 0:
+      self._removeOverlapsTTF(ufo)
+      for i, outputFilename in enumerate(ttfs):
+        inplace = (i == len(ttfs) - 1)
+        self._compileStatic(ufo, outputFilename, False, inplace, **kwargs)
+
+
+  def _removeOverlapsTTF(self, ufo):
+    # Removes overlaps in all glyphs, ahead of compiling TTFs with ufo2ft's own overlap
+    # removal turned off, so that results can be looked up in self.overlapCache.
+    with timing.stage('remove overlaps'):
+      log.info('Removing overlaps')
+      # Before removing overlaps, ufo2ft decomposes components referencing glyphs which
+      # are not exported, and glyphs with both contours and components.
+      # Do the same so that these are merged with the rest of the glyph.
+      skipExportGlyphs = ufo.lib.get('public.skipExportGlyphs', [])
+      if skipExportGlyphs:  # the filter fails when given an empty list
+        SkipExportGlyphsFilter(skipExportGlyphs)(ufo)
+      DecomposeComponentsFilter(include=lambda g: len(g))(ufo)
+      CachedRemoveOverlapsFilter(backend='pathops', cache=self.overlapCache)(ufo)
+
+
+  def _compileStatic(self, ufo, outputFilename, cff, inplace, **kwargs):
+    # inplace=False leaves ufo unmodified, so it can be compiled again.
+    # For TTF, overlaps must already have been removed with _removeOverlapsTTF.
     compilerOptions = dict(
       useProductionNames=True,
-      inplace=True,  # avoid extra copy
-      removeOverlaps=True,
-      overlapsBackend='pathops', # use Skia's pathops
+      inplace=inplace,  # avoid extra copy
+      removeOverlaps=False,
+      featureCompilerClass=cachedFeatureCompilerClass(self.featureCache),
     )
+    compilerOptions.update(kwargs)
+    if cff:
+      # Remove overlaps after all components have been decomposed, like ufo2ft does
+      # with removeOverlaps=True, but with results looked up in self.overlapCache.
+      # "..." stands for the filters of the UFO's lib. Post-filters run in list order,
+      # so listing ours first removes overlaps before the UFO's post-filters, as the
+      # default filters of ufo2ft are.
+      compilerOptions['filters'] = [CachedRemoveOverlapsFilter(
+        backend='pathops', pre=False, cache=self.overlapCache), ...]
+      compilerOptions.pop('flattenComponents', None)  # TTF only
 
     log.info("compiling %s -> %s (%s)", _LazyFontName(ufo), outputFilename,
              "OTF/CFF-2" if cff else "TTF")
 
-    if cff:
-      font = ufo2ft.compileOTF(ufo, **compilerOptions)
-    else: # ttf
-      font = ufo2ft.compileTTF(ufo, **compilerOptions)
+    with timing.stage('compile otf' if cff else 'compile ttf'):
+      if cff:
+        font = ufo2ft.compileOTF(ufo, **compilerOptions)
+      else: # ttf
+        font = ufo2ft.compileTTF(ufo, **compilerOptions)
 
-    log.debug("writing %s", outputFilename)
-    font.save(outputFilename)
+      log.debug("writing %s", outputFilename)
+      with timing.stage('save'):
+        font.save(outputFilename)
 
 
 
@@ -62,40 +202,59 @@ class FontBuilder:
     cff=False,      # if true, builds CFF-2 font, else TTF
     **kwargs,       # passed along to ufo2ft.compileVariable*()
   ):
-    designspace = self._loadDesignspace(designspace)
+    with timing.build(basename(outputFilename), 'compile-var'):
+      designspace = self._loadDesignspace(designspace)
 
-    # check in the designspace's <lib> element if user supplied a custom featureWriters
-    # configuration; if so, use that for all the UFOs built from this designspace.
-    featureWriters = None
-    if ufo2ft.featureWriters.FEATURE_WRITERS_KEY in designspace.lib:
-      featureWriters = ufo2ft.featureWriters.loadFeatureWriters(designspace)
+      # check in the designspace's <lib> element if user supplied a custom featureWriters
+      # configuration; if so, use that for all the UFOs built from this designspace.
+      featureWriters = None
+      if ufo2ft.featureWriters.FEATURE_WRITERS_KEY in designspace.lib:
+        featureWriters = ufo2ft.featureWriters.loadFeatureWriters(designspace)
 
-    compilerOptions = dict(
-      useProductionNames=True,
-      featureWriters=featureWriters,
-      inplace=True,  # avoid extra copy
-      **kwargs
-    )
+      compilerOptions = dict(
+        useProductionNames=True,
+        featureWriters=featureWriters,
+        inplace=True,  # avoid extra copy
+      )
+      compilerOptions.update(kwargs)
 
-    if log.isEnabledFor(logging.INFO):
-      log.info("compiling %s -> %s (%s)", designspace.path, outputFilename,
-               "OTF/CFF-2" if cff else "TTF")
+      if timing.enabled():
+        # ufo2ft doesn't time these stages of variable font compilation
+        if cff:
+          preProcessorClass = OTFInterpolatablePreProcessor
+          outlineCompilerClass = OutlineOTFCompiler
+        else:
+          preProcessorClass = TTFInterpolatablePreProcessor
+          outlineCompilerClass = OutlineTTFCompiler
+        compilerOptions.setdefault('preProcessorClass', timing.timedClass(
+          preProcessorClass, 'process', 'ufo2ft preprocess'))
+        compilerOptions.setdefault('outlineCompilerClass', timing.timedClass(
+          outlineCompilerClass, 'compile', 'outline compile'))
+        compilerOptions.setdefault('postProcessorClass', timing.timedClass(
+          PostProcessor, 'process', 'postprocess'))
 
-    if cff:
-      font = ufo2ft.compileVariableCFF2(designspace, **compilerOptions)
-    else:
-      font = ufo2ft.compileVariableTTF(designspace, **compilerOptions)
+      if log.isEnabledFor(logging.INFO):
+        log.info("compiling %s -> %s (%s)", designspace.path, outputFilename,
+                 "OTF/CFF-2" if cff else "TTF")
 
-    # Rename fullName record to familyName (VF only).
-    # Note: Even though we set openTypeNameCompatibleFullName it seems that the fullName
-    # record is still computed by fonttools, so we override it here.
-    setFullName(font, getFamilyName(font))
+      with timing.stage('compile'):
+        if cff:
+          font = ufo2ft.compileVariableCFF2(designspace, **compilerOptions)
+        else:
+          font = ufo2ft.compileVariableTTF(designspace, **compilerOptions)
 
-    # rebuild STAT table to correct VF instance information
-    rebuildStatTable(font, designspace)
+      with timing.stage('STAT rebuild'):
+        # Rename fullName record to familyName (VF only).
+        # Note: Even though we set openTypeNameCompatibleFullName it seems that the
+        # fullName record is still computed by fonttools, so we override it here.
+        setFullName(font, getFamilyName(font))
 
-    log.debug("writing %s", outputFilename)
-    font.save(outputFilename)
+        # rebuild STAT table to correct VF instance information
+        rebuildStatTable(font, designspace)
+
+      log.debug("writing %s", outputFilename)
+      with timing.stage('save'):
+        font.save(outputFilename)
 
 
   def _decompose(self, ufos, glyphNamesToDecompose):
@@ -105,7 +264,8 @@ class FontBuilder:
         log.debug('Decomposing glyphs:\n  %s', "\n  ".join(glyphNamesToDecompose))
       elif log.isEnabledFor(logging.INFO):
         log.info('Decomposing %d glyphs', len(glyphNamesToDecompose))
-      decomposeGlyphs(ufos, glyphNamesToDecompose)
+      with timing.stage('decompose'):
+        decomposeGlyphs(ufos, glyphNamesToDecompose)
 
   def _shouldDecomposeGlyph(self, g, directives, componentReferences):
     # Note: Used for building both static and variable fonts
@@ -134,13 +294,14 @@ class FontBuilder:
   def _loadDesignspace(self, designspace):
     # Note: Only used for building variable fonts
     log.info("loading designspace sources")
-    if isinstance(designspace, str):
-      designspace = DesignSpaceDocument.fromfile(designspace)
-    else:
-      # copy that we can mess with
-      designspace = DesignSpaceDocument.fromfile(designspace.path)
+    with timing.stage('load designspace'):
+      if isinstance(designspace, str):
+        designspace = DesignSpaceDocument.fromfile(designspace)
+      else:
+        # copy that we can mess with
+        designspace = DesignSpaceDocument.fromfile(designspace.path)
 
-    masters = designspace.loadSourceFonts(opener=Font)
+      masters = designspace.loadSourceFonts(opener=loadFont)
     # masters = [s.font for s in designspace.sources]  # list of UFO font objects
 
     # Update the default source's full name to not include style name
@@ -148,32 +309,37 @@ class FontBuilder:
     defaultFont.info.openTypeNameCompatibleFullName = defaultFont.info.familyName
 
     log.info("Preprocessing glyphs")
-    # find glyphs subject to decomposition and/or overlap removal
-    # TODO: Find out why this loop is SO DAMN SLOW. It might just be so that defcon is
-    #       really slow when reading glyphs. Perhaps we can sidestep defcon and just
-    #       read & parse the .glif files ourselves.
-    glyphNamesToDecompose  = set()  # glyph names
-    glyphsToRemoveOverlaps = set()  # glyph objects
-    for ufo in masters:
-      # Note: ufo is of type defcon.objects.font.Font
-      # update font version
-      updateFontVersion(ufo, dummy=False, isVF=True)
-      componentReferences = set(ufo.componentReferences)
-      for g in ufo:
-        directives = findGlyphDirectives(g.note)
-        if self._shouldDecomposeGlyph(g, directives, componentReferences):
-          glyphNamesToDecompose.add(g.name)
-        if 'removeoverlap' in directives:
-          if g.components and len(g.components) > 0:
+    # find glyphs subject to decomposition and/or overlap removal.
+    # Glyph notes and components are read straight from the .glif files with GlifReader
+    # rather than through defcon, which would load every glyph of every master.
+    # Only glyphs that are actually modified below are loaded by defcon.
+    with timing.stage('preprocess glyphs'):
+      glyphNamesToDecompose  = set()  # glyph names
+      glyphsToRemoveOverlaps = set()  # glyph objects
+      visited = set()  # UFO paths
+      for source in designspace.sources:
+        ufo = source.font
+        if source.path in visited:
+          continue
+        visited.add(source.path)
+        # Note: ufo is of type defcon.objects.font.Font
+        # update font version
+        updateFontVersion(ufo, dummy=False, isVF=True)
+        glyphs = GlifReader(source.path)
+        componentReferences = set(glyphs.componentReferences)
+        for g in glyphs:
+          directives = findGlyphDirectives(g.note)
+          if self._shouldDecomposeGlyph(g, directives, componentReferences):
             glyphNamesToDecompose.add(g.name)
-          glyphsToRemoveOverlaps.add(g)
+          if 'removeoverlap' in directives:
+            if g.components and len(g.components) > 0:
+              glyphNamesToDecompose.add(g.name)
+            glyphsToRemoveOverlaps.add(ufo[g.name])
 
     self._decompose(masters, glyphNamesToDecompose)
 
     # remove overlaps
     if glyphsToRemoveOverlaps:
-      rmoverlapFilter = RemoveOverlapsFilter(backend='pathops')
-      rmoverlapFilter.start()
       if log.isEnabledFor(logging.DEBUG):
         log.debug(
           'Removing overlaps in glyphs:\n  %s',
@@ -181,9 +347,20 @@ class FontBuilder:
         )
       elif log.isEnabledFor(logging.INFO):
         log.info('Removing overlaps in %d glyphs', len(glyphsToRemoveOverlaps))
-      for g in glyphsToRemoveOverlaps:
-        rmoverlapFilter.filter(g)
+      # in parallel, for all masters at once
+      with timing.stage('remove overlaps'):
+        removeOverlaps(glyphsToRemoveOverlaps, cache=self.overlapCache)
 
     # handle control back to fontmake
     return designspace
 
+
+
+def _buildStaticsProc(task):
+  # Runs in a worker process of FontBuilder.buildStatics
+  ufoPath, outdir, formats, productionNames, overlapCache, featureCache = task
+  name = splitext(basename(ufoPath.rstrip(os.sep)))[0]
+  outputFilenames = [pjoin(outdir, name + '.' + format) for format in formats]
+  FontBuilder(overlapCache, featureCache).buildStaticFormats(
+    ufoPath, outputFilenames, productionNames=productionNames)
+  return outputFilenames
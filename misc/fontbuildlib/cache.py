@@ -0,0 +1,296 @@
+import os
+import sys
+import pickle
+import shutil
+import sqlite3
+import hashlib
+import logging
+import plistlib
+from xml.etree import ElementTree
+from os.path import dirname, basename, isdir, isfile, join as pjoin
+from .util import BASEDIR, mkdirs
+from .ufo import GLYPH_DIGESTS_FILENAME
+
+# Content-addressed cache of build products.
+#
+# A cache key is the hash of the contents of all input files (a directory input, like a
+# UFO, is hashed file by file), the command arguments and the versions of the tools
+# involved. Modification times are never looked at, which means that products survive a
+# fresh checkout or a "git checkout" which touches files without changing them.
+#
+# Products are stored at build/cache/<key[:2]>/<key>/
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = pjoin(BASEDIR, 'build', 'cache')
+
+# Bump this to invalidate all existing cache entries
+CACHE_FORMAT_VERSION = 1
+
+# Python packages whose versions are part of every cache key
+TOOL_PACKAGES = [
+  'fonttools',
+  'ufo2ft',
+  'fontmake',
+  'glyphsLib',
+  'glyphspkg',
+  'defcon',
+  'ufoLib2',
+  'skia-pathops',
+  'cffsubr',
+  'psautohint',
+  'ttfautohint-py',
+  'brotli',
+]
+
+# fontinfo.plist keys which change on every build without changing the product in any
+# meaningful way. Ignored when hashing UFOs.
+VOLATILE_FONTINFO_KEYS = set([
+  'openTypeHeadCreated',
+])
+
+# Files which record when and how a UFO was written rather than what's in it
+# (see saveUFOIncremental.) Ignored when hashing UFOs.
+VOLATILE_FILENAMES = set([
+  GLYPH_DIGESTS_FILENAME,
+])
+
+_HASH_BUFSIZE = 1024 * 1024
+_toolVersions = None
+
+
+def toolVersions():  # -> [(name, version)]
+  global _toolVersions
+  if _toolVersions is None:
+    from importlib.metadata import version, PackageNotFoundError
+    _toolVersions = [('python', '%d.%d' % sys.version_info[:2])]
+    for name in TOOL_PACKAGES:
+      try:
+        _toolVersions.append((name, version(name)))
+      except PackageNotFoundError:
+        _toolVersions.append((name, ''))
+  return _toolVersions
+
+
+def _designspaceSourcePaths(filename):
+  # paths of all source UFOs referenced by a designspace file
+  paths = []
+  dir = dirname(filename)
+  for el in ElementTree.parse(filename).getroot().iter('source'):
+    sourceFilename = el.get('filename')
+    if sourceFilename:
+      paths.append(os.path.normpath(pjoin(dir, sourceFilename)))
+  return paths
+
+
+class SqliteCache:
+  # Base class of caches stored in a sqlite database (OverlapCache, FeatureCache) which
+  # map keys to pickled values. The database can be shared by concurrent processes, and
+  # cache objects can be passed to worker processes, which make their own connection.
+  #
+  # Subclasses define TABLE and COLUMN (names of the database table and of its value
+  # column), FORMAT_VERSION, KEY_TOOLS (names of TOOL_PACKAGES whose versions are part
+  # of every key) and put(), which stores values with _insert().
+  TABLE = None
+  COLUMN = None
+  FORMAT_VERSION = 1
+  KEY_TOOLS = ()
+
+
+  def __init__(self, filename):
+    self.filename = filename
+    self._db = None
+    self._pid = None
+    self._keyPrefix = None
+
+
+  def __getstate__(self):
+    # database connections can't be passed to other processes
+    return {'filename': self.filename}
+
+
+  def __setstate__(self, state):
+    self.__init__(state['filename'])
+
+
+  def _hash(self):
+    # Returns a sha1 hash to compute a key with, which starts with FORMAT_VERSION and
+    # the versions of KEY_TOOLS
+    if self._keyPrefix is None:
+      versions = dict(toolVersions())
+      self._keyPrefix = repr(
+        (self.FORMAT_VERSION,) + tuple(versions.get(name) for name in self.KEY_TOOLS)
+      ).encode('utf-8')
+    return hashlib.sha1(self._keyPrefix)
+
+
+  def get(self, key):  # -> value | None
+    row = self._connection().execute(
+      'SELECT %s FROM %s WHERE key = ?' % (self.COLUMN, self.TABLE), (key,)).fetchone()
+    if row is None:
+      return None
+    return pickle.loads(row[0])
+
+
+  def _insert(self, entries):
+    # Stores entries; [(key, value)]. Existing entries are kept.
+    rows = [(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)) for key, value in entries]
+    db = self._connection()
+    with db:
+      db.executemany(
+        'INSERT OR IGNORE INTO %s (key, %s) VALUES (?, ?)' % (self.TABLE, self.COLUMN),
+        rows)
+
+
+  def _forked(self):
+    # Called in a forked process before it makes its own connection
+    pass
+
+
+  def _connection(self):
+    if self._db is None or self._pid != os.getpid():
+      # (re)connect; a forked process must not use its parent's connection
+      if self._pid is not None:
+        self._forked()
+      mkdirs(dirname(self.filename))
+      self._db = sqlite3.connect(self.filename, timeout=60)
+      self._db.execute('CREATE TABLE IF NOT EXISTS %s (key TEXT PRIMARY KEY, %s BLOB)' % (
+        self.TABLE, self.COLUMN))
+      self._pid = os.getpid()
+    return self._db
+
+
+class BuildCache:
+
+  def __init__(self, cachedir=DEFAULT_CACHE_DIR):
+    self.cachedir = cachedir
+
+
+  def key(self, inputs, args=(), extra=()):
+    # inputs : files and/or directories whose contents are hashed
+    # args   : command arguments, e.g. ['fontmake', '-o', 'otf', ...]
+    # extra  : any other strings which affect the result (e.g. version and git hash)
+    h = hashlib.sha256()
+    self._update(h, 'v%d' % CACHE_FORMAT_VERSION)
+    for name, version in toolVersions():
+      self._update(h, '%s=%s' % (name, version))
+    for s in args:
+      self._update(h, 'arg:' + str(s))
+    for s in extra:
+      self._update(h, 'extra:' + str(s))
+    for path in self._expandInputs(inputs):
+      self._hashPath(h, path)
+    return h.hexdigest()
+
+
+  def restore(self, key, outputs):
+    # Copies the products of cache entry key to outputs. Returns False on cache miss.
+    entry = self._entryDir(key)
+    if not isdir(entry):
+      return False
+    files = [self._entryFile(entry, i, path) for i, path in enumerate(outputs)]
+    for file in files:
+      if not os.path.exists(file):
+        log.warning('incomplete cache entry %s; ignoring it', entry)
+        return False
+    for file, path in zip(files, outputs):
+      log.debug('restore %s from %s', path, file)
+      self._copy(file, path)
+    return True
+
+
+  def store(self, key, outputs):
+    entry = self._entryDir(key)
+    if isdir(entry):
+      return
+    # write to a temporary directory which is then renamed, so that concurrent builds
+    # never observe a partially written entry
+    tmpentry = '%s.tmp%d' % (entry, os.getpid())
+    mkdirs(tmpentry)
+    try:
+      for i, path in enumerate(outputs):
+        self._copy(path, self._entryFile(tmpentry, i, path))
+      os.rename(tmpentry, entry)
+    except OSError:
+      # another process stored the same entry before us
+      if not isdir(entry):
+        raise
+    finally:
+      if isdir(tmpentry):
+        shutil.rmtree(tmpentry)
+    log.debug('stored %s', entry)
+
+
+  def _entryDir(self, key):
+    return pjoin(self.cachedir, key[:2], key)
+
+
+  def _entryFile(self, entry, index, path):
+    return pjoin(entry, '%d.%s' % (index, basename(path.rstrip(os.sep))))
+
+
+  def _copy(self, src, dst):
+    tmpdst = dst.rstrip(os.sep) + '.tmp%d' % os.getpid()
+    if isdir(src):
+      shutil.copytree(src, tmpdst)
+      if isdir(dst):
+        shutil.rmtree(dst)
+    else:
+      mkdirs(dirname(dst) or '.')
+      shutil.copyfile(src, tmpdst)
+    os.replace(tmpdst, dst)
+
+
+  def _expandInputs(self, inputs):
+    # designspace files depend on their source UFOs
+    paths = []
+    seen = set()
+    for path in inputs:
+      more = [path]
+      if path.endswith('.designspace') and isfile(path):
+        more += _designspaceSourcePaths(path)
+      for path in more:
+        path = os.path.normpath(path)
+        if path not in seen:
+          seen.add(path)
+          paths.append(path)
+    return paths
+
+
+  def _hashPath(self, h, path):
+    if isdir(path):
+      for dirpath, dirnames, filenames in os.walk(path, followlinks=True):
+        dirnames[:] = sorted(
+          d for d in dirnames if not d.startswith('.') and d != '__pycache__')
+        for filename in sorted(filenames):
+          if filename.startswith('.') or filename in VOLATILE_FILENAMES:
+            continue
+          filename = pjoin(dirpath, filename)
+          self._update(h, 'file:' + os.path.relpath(filename, path))
+          self._hashFile(h, filename)
+    elif isfile(path):
+      self._update(h, 'file:' + basename(path))
+      self._hashFile(h, path)
+    else:
+      raise FileNotFoundError('cache input not found: %r' % path)
+
+
+  def _hashFile(self, h, filename):
+    if basename(filename) == 'fontinfo.plist':
+      with open(filename, 'rb') as f:
+        info = plistlib.load(f)
+      for k in VOLATILE_FONTINFO_KEYS:
+        info.pop(k, None)
+      h.update(plistlib.dumps(info, sort_keys=True))
+      return
+    with open(filename, 'rb') as f:
+      while True:
+        buf = f.read(_HASH_BUFSIZE)
+        if not buf:
+          break
+        h.update(buf)
+
+
+  def _update(self, h, s):
+    h.update(s.encode('utf-8'))
+    h.update(b'\0')
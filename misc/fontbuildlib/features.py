@@ -0,0 +1,218 @@
+import re
+import logging
+from os.path import join as pjoin
+from fontTools.feaLib.builder import Builder, addOpenTypeFeaturesFromString
+from fontTools.feaLib.error import FeatureLibError
+from fontTools.ttLib import newTable
+from fontTools.ttLib.tables.DefaultTable import DefaultTable
+from ufo2ft.featureCompiler import FeatureCompiler, parseLayoutFeatures, timer
+from ufo2ft.featureWriters import (
+  CursFeatureWriter,
+  GdefFeatureWriter,
+  KernFeatureWriter,
+  MarkFeatureWriter,
+)
+from .cache import DEFAULT_CACHE_DIR, SqliteCache
+
+# OpenType feature compilation with a persistent cache of results.
+#
+# Compiling features with feaLib takes a few seconds per font, and every static style is
+# compiled twice (OTF and TTF) from exactly the same feature code. All styles also share
+# the same features in src/features, which make up all of GSUB, and only differ in the
+# kerning and mark positioning code written by ufo2ft's feature writers (GPOS and GDEF.)
+#
+# CachedFeatureCompiler, a ufo2ft FeatureCompiler, looks up compiled tables in a
+# FeatureCache at two levels:
+#
+#   - All tables made by feaLib, keyed by the complete feature code (after the feature
+#     writers have run), the glyph order and the font's user-defined names. A hit skips
+#     feaLib entirely, e.g. when compiling the TTF after the OTF of a style, or when
+#     rebuilding a font whose glyphs were edited but not its kerning or anchors.
+#
+#   - GSUB, keyed by the font's own feature code (with includes), the glyph order and
+#     the font's user-defined names. A hit skips building GSUB, which is then the same
+#     for all styles with the same glyph set. feaLib still parses all of the feature
+#     code, so that GDEF and GPOS come out the same as when GSUB is built too. Not used
+#     when lookups refer to GDEF mark classes or sets, whose numbering depends on all
+#     of the feature code, or when feature writers which may make GSUB lookups are used.
+#
+# Tables are stored compiled and put into fonts as such, so that they aren't compiled
+# again when the font is saved. The cache is a sqlite database at build/cache/features.db
+# which can be shared by concurrent processes.
+
+log = logging.getLogger(__name__)
+
+DEFAULT_FEATURE_CACHE_FILE = pjoin(DEFAULT_CACHE_DIR, 'features.db')
+
+# Bump this to invalidate all existing cache entries
+FEATURE_CACHE_FORMAT_VERSION = 1
+
+# tables made by feaLib from feature code which doesn't have "table" blocks for others
+LAYOUT_TABLES = ('GDEF', 'GSUB', 'GPOS', 'BASE')
+
+# feature writers which only make GPOS and GDEF
+_GPOS_FEATURE_WRITERS = (
+  KernFeatureWriter,
+  MarkFeatureWriter,
+  GdefFeatureWriter,
+  CursFeatureWriter,
+)
+
+# feature code changing tables other than LAYOUT_TABLES and user-defined names
+_TABLE_BLOCK_RE = re.compile(r'\btable\s+(?!GDEF\b|BASE\b)\S+\s*\{')
+
+# lookup flags referring to GDEF MarkAttachClassDef and MarkGlyphSetsDef
+_GDEF_LOOKUPFLAG_RE = re.compile(r'\b(MarkAttachmentType|UseMarkFilteringSet)\b')
+
+
+class FeatureCache(SqliteCache):
+  # Maps feature code, glyph order and names of fonts to their compiled tables
+  TABLE = 'features'
+  COLUMN = 'tables'
+  FORMAT_VERSION = FEATURE_CACHE_FORMAT_VERSION
+  KEY_TOOLS = ('fonttools', 'ufo2ft')
+
+
+  def __init__(self, filename=DEFAULT_FEATURE_CACHE_FILE):
+    super().__init__(filename)
+
+
+  def key(self, kind, ttFont, features):
+    # kind is "layout" (all tables) or "GSUB"
+    h = self._hash()
+    h.update(repr((
+      kind,
+      sorted((k, repr(v)) for k, v in ttFont.cfg.items()),
+      _userNames(ttFont),
+    )).encode('utf-8'))
+    h.update('\0'.join(ttFont.getGlyphOrder()).encode('utf-8'))
+    h.update(b'\0\0')
+    h.update(features.encode('utf-8'))
+    return h.hexdigest()
+
+
+  def put(self, key, entry):
+    self._insert([(key, entry)])
+
+
+class CompiledTable(DefaultTable):
+  # A table which is already compiled, written to font files as is. It's decompiled into
+  # a regular table, which replaces it in the font, when anything looks inside it.
+
+  def __init__(self, tag, data, font):
+    DefaultTable.__init__(self, tag)
+    self.data = data
+    self._font = font
+
+  def __getattr__(self, attr):
+    if attr.startswith('__') or attr in ('data', '_font', 'tableTag'):
+      raise AttributeError(attr)
+    table = newTable(self.tableTag)
+    table.decompile(self.data, self._font)
+    if self._font.tables.get(self.tableTag) is self:
+      self._font[self.tableTag] = table
+    return getattr(table, attr)
+
+
+class CachedFeatureCompiler(FeatureCompiler):
+  # FeatureCompiler which looks up compiled tables in a FeatureCache before running
+  # feaLib. Make a class with a cache using cachedFeatureCompilerClass(cache) and pass it
+  # to ufo2ft as featureCompilerClass. With cache=None, this is just a FeatureCompiler.
+  cache = None
+
+
+  def buildTables(self):
+    cache = self.cache
+    if (cache is None or not self.features or not self.featureWriters or
+        _TABLE_BLOCK_RE.search(self.features)):
+      return super().buildTables()
+    ttFont = self.ttFont
+
+    key = cache.key('layout', ttFont, self.features)
+    entry = cache.get(key)
+    if entry is not None:
+      log.debug('using cached feature tables %s', key)
+      with timer("build OpenType features"):
+        _installTables(ttFont, entry)
+      return
+
+    gsubKey = None
+    gsub = None
+    if all(isinstance(w, _GPOS_FEATURE_WRITERS) for w in self.featureWriters):
+      source = parseLayoutFeatures(self.ufo, getattr(self, 'feaIncludeDir', None)).asFea()
+      if not _GDEF_LOOKUPFLAG_RE.search(source):
+        gsubKey = cache.key('GSUB', ttFont, source)
+        gsub = cache.get(gsubKey)
+
+    namesBefore = set(_userNames(ttFont))
+    with timer("build OpenType features"):
+      if gsub is not None:
+        log.debug('using cached GSUB %s', gsubKey)
+        _installTables(ttFont, gsub)
+        self._build(tables=Builder.supportedTables - {'GSUB'})
+      else:
+        self._build()
+      entry = _compileTables(ttFont, LAYOUT_TABLES, gsub['tables'] if gsub else {})
+
+    entry['names'] = [n for n in _userNames(ttFont) if n not in namesBefore]
+    if 'OS/2' in ttFont:
+      entry['usMaxContext'] = ttFont['OS/2'].usMaxContext
+    cache.put(key, entry)
+    if gsubKey is not None and gsub is None:
+      cache.put(gsubKey, {'tables': {'GSUB': entry['tables'].get('GSUB')}})
+
+
+  def _build(self, tables=None):
+    # feature code is self-contained since feature writers have run (see buildTables)
+    try:
+      addOpenTypeFeaturesFromString(self.ttFont, self.features, tables=tables)
+    except FeatureLibError:
+      self._write_temporary_feature_file(self.features)
+      raise
+
+
+def cachedFeatureCompilerClass(cache):
+  # Returns a CachedFeatureCompiler class which uses cache (a FeatureCache or None)
+  return type('CachedFeatureCompiler', (CachedFeatureCompiler,), {'cache': cache})
+
+
+def _userNames(ttFont):
+  # name records with user-defined name IDs, e.g. of feature names
+  if 'name' not in ttFont:
+    return []
+  return sorted(
+    (n.nameID, n.platformID, n.platEncID, n.langID, n.toUnicode())
+    for n in ttFont['name'].names if n.nameID >= 256)
+
+
+def _compileTables(ttFont, tags, compiled):
+  # Compiles tables of ttFont, replacing them with CompiledTables. compiled maps tags of
+  # tables which were taken from the cache to their data, which is used as is.
+  # Returns a cache entry of the tables; data of tags, or None for tables not in ttFont.
+  tables = {}
+  for tag in tags:
+    if tag in ttFont:
+      data = compiled.get(tag)
+      if data is None:
+        data = ttFont[tag].compile(ttFont)
+      ttFont[tag] = CompiledTable(tag, data, ttFont)
+      tables[tag] = data
+    else:
+      tables[tag] = None
+  return {'tables': tables}
+
+
+def _installTables(ttFont, entry):
+  # Puts the tables of a cache entry made by _compileTables into ttFont
+  for tag, data in entry['tables'].items():
+    if data is not None:
+      ttFont[tag] = CompiledTable(tag, data, ttFont)
+    elif tag in ttFont:
+      del ttFont[tag]
+  if entry.get('names'):
+    nameTable = ttFont['name']
+    for nameID, platformID, platEncID, langID, string in entry['names']:
+      nameTable.setName(string, nameID, platformID, platEncID, langID)
+    nameTable.names.sort()
+  if 'usMaxContext' in entry and 'OS/2' in ttFont:
+    ttFont['OS/2'].usMaxContext = entry['usMaxContext']
@@ -0,0 +1,149 @@
+import plistlib
+from xml.etree import ElementTree
+from os.path import join as pjoin
+
+# Lightweight, read-only access to the glyphs of a UFO.
+#
+# defcon materializes every glyph (contours, points, anchors, lib, ...) when you iterate
+# over a font, which is very slow for fonts with thousands of glyphs. When all we need is
+# a glyph's note and components (e.g. to find glyphs to decompose), this module reads
+# the .glif files directly and only parses a glyph when one of its properties is first
+# accessed. Contours are never parsed.
+#
+# GlifGlyph has the same shape as defcon's Glyph for the properties it provides, so it
+# can be passed to functions like findGlyphDirectives and composedGlyphIsTrivial.
+
+DEFAULT_LAYER_NAME = 'public.default'
+
+_componentTransformAttrs = (
+  ('xScale', 1), ('xyScale', 0), ('yxScale', 0), ('yScale', 1),
+  ('xOffset', 0), ('yOffset', 0),
+)
+
+
+def _number(s):
+  v = float(s)
+  if v.is_integer():
+    return int(v)
+  return v
+
+
+class GlifComponent:
+  __slots__ = ('baseGlyph', 'transformation')
+
+  def __init__(self, baseGlyph, transformation):
+    self.baseGlyph = baseGlyph
+    self.transformation = transformation  # (xx, xy, yx, yy, dx, dy)
+
+  def __repr__(self):
+    return '<GlifComponent %r %r>' % (self.baseGlyph, self.transformation)
+
+
+class GlifGlyph:
+  __slots__ = ('name', 'path', '_note', '_components', '_unicodes')
+
+  def __init__(self, name, path):
+    self.name = name
+    self.path = path
+    self._note = None
+    self._components = None  # parsed when not None
+    self._unicodes = None
+
+  def __repr__(self):
+    return '<GlifGlyph %r>' % self.name
+
+  @property
+  def note(self):
+    if self._components is None:
+      self._parse()
+    return self._note
+
+  @property
+  def components(self):
+    if self._components is None:
+      self._parse()
+    return self._components
+
+  @property
+  def unicodes(self):
+    if self._components is None:
+      self._parse()
+    return self._unicodes
+
+  def _parse(self):
+    with open(self.path, 'rb') as f:
+      root = ElementTree.fromstring(f.read())
+    note = None
+    unicodes = []
+    components = []
+    for el in root:
+      tag = el.tag
+      if tag == 'outline':
+        for c in el.iterfind('component'):
+          attrs = c.attrib
+          components.append(GlifComponent(
+            attrs['base'],
+            tuple(_number(attrs[k]) if k in attrs else v
+                  for k, v in _componentTransformAttrs),
+          ))
+      elif tag == 'note':
+        note = el.text
+      elif tag == 'unicode':
+        unicodes.append(int(el.attrib['hex'], 16))
+    self._note = note
+    self._unicodes = unicodes
+    self._components = components
+
+
+class GlifReader:
+  """
+  Reads glyphs of one layer of a UFO, without loading them up front.
+  Iterating yields GlifGlyph objects in contents.plist order.
+  """
+
+  def __init__(self, ufoPath, layerName=None):
+    self.path = ufoPath
+    self.glyphsDir = pjoin(ufoPath, self._layerDirName(ufoPath, layerName))
+    with open(pjoin(self.glyphsDir, 'contents.plist'), 'rb') as f:
+      contents = plistlib.load(f)  # { glyphname: filename }
+    self._glyphs = {
+      name: GlifGlyph(name, pjoin(self.glyphsDir, filename))
+      for name, filename in contents.items()
+    }
+    self._componentReferences = None
+
+  def _layerDirName(self, ufoPath, layerName):
+    if layerName is None or layerName == DEFAULT_LAYER_NAME:
+      return 'glyphs'
+    with open(pjoin(ufoPath, 'layercontents.plist'), 'rb') as f:
+      for name, dirname in plistlib.load(f):
+        if name == layerName:
+          return dirname
+    raise KeyError('layer %r not found in %s' % (layerName, ufoPath))
+
+  def __len__(self):
+    return len(self._glyphs)
+
+  def __contains__(self, name):
+    return name in self._glyphs
+
+  def __getitem__(self, name):
+    return self._glyphs[name]
+
+  def __iter__(self):
+    return iter(self._glyphs.values())
+
+  def keys(self):
+    return self._glyphs.keys()
+
+  @property
+  def componentReferences(self):
+    # { base_glyph_name: set(names of glyphs using it as a component) }
+    # Same as defcon's Font.componentReferences
+    if self._componentReferences is None:
+      refs = {}
+      for g in self._glyphs.values():
+        for c in g.components:
+          refs.setdefault(c.baseGlyph, set()).add(g.name)
+      self._componentReferences = refs
+    return self._componentReferences
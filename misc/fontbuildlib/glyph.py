@@ -2,6 +2,7 @@ import re
 from fontTools.pens.transformPen import TransformPen
 from fontTools.misc.transform import Transform
 from fontTools.pens.reverseContourPen import ReverseContourPen
+from fontTools.pens.recordingPen import RecordingPen, replayRecording
 
 # Directives are glyph-specific post-processing directives for the compiler.
 # A directive is added to the "note" section of a glyph and takes the
@@ -61,27 +62,56 @@ def composedGlyphIsTrivial(g):
 
 def decomposeGlyphs(ufos, glyphNamesToDecompose):
   for ufo in ufos:
+    # Flattened contours of component base glyphs, shared by all glyphs of this ufo.
+    # Bases like accents are used by hundreds of composites, often with the same
+    # transformation, so each (glyph, transformation) is only flattened once.
+    # All glyphs are flattened before any is modified, so that the result does not
+    # depend on the order in which glyphs are decomposed.
+    flattened = {}  # (glyph name, transformation) => recorded pen operations
+    decomposed = []
     for glyphname in glyphNamesToDecompose:
       glyph = ufo[glyphname]
-      _deepCopyContours(ufo, glyph, glyph, Transform())
+      decomposed.append((glyph, [
+        _flattenedContours(ufo, c.baseGlyph, c.transformation, flattened)
+        for c in glyph.components
+      ]))
+    for glyph, recordings in decomposed:
+      # post one change notification per glyph instead of one per contour
+      glyph.holdNotifications()
+      pen = glyph.getPen()
+      for recording in recordings:
+        replayRecording(recording, pen)
       glyph.clearComponents()
+      glyph.releaseHeldNotifications()
 
 
 
-def _deepCopyContours(ufo, parent, component, transformation):
-  """Copy contours from component to parent, including nested components."""
-  for nested in component.components:
-    _deepCopyContours(
-      ufo,
-      parent,
-      ufo[nested.baseGlyph],
-      transformation.transform(nested.transformation)
-    )
-  if component != parent:
-    pen = TransformPen(parent.getPen(), transformation)
-    # if the transformation has a negative determinant, it will reverse
-    # the contour direction of the component
-    xx, xy, yx, yy = transformation[:4]
-    if xx*yy - xy*yx < 0:
-      pen = ReverseContourPen(pen)
-    component.draw(pen)
\ No newline at end of file
+def _flattenedContours(ufo, glyphname, transformation, cache):
+  """
+  Returns the contours of a glyph, including those of its nested components, with
+  transformation applied, as a RecordingPen value. The contours of the glyph come
+  first, followed by those of its components; the same order the glyph has after
+  being decomposed, which makes the result independent of the order glyphs are
+  decomposed in.
+  """
+  key = (glyphname, tuple(transformation))
+  value = cache.get(key)
+  if value is not None:
+    return value
+  glyph = ufo[glyphname]
+  transformation = Transform(*transformation)
+  recording = RecordingPen()
+  pen = TransformPen(recording, transformation)
+  # if the transformation has a negative determinant, it will reverse
+  # the contour direction of the component
+  xx, xy, yx, yy = transformation[:4]
+  if xx*yy - xy*yx < 0:
+    pen = ReverseContourPen(pen)
+  for contour in glyph:
+    contour.draw(pen)
+  value = recording.value
+  for nested in glyph.components:
+    value = value + _flattenedContours(
+      ufo, nested.baseGlyph, transformation.transform(nested.transformation), cache)
+  cache[key] = value
+  return value
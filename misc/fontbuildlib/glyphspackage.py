@@ -0,0 +1,253 @@
+import os
+import gc
+import logging
+import openstep_plist
+from collections import deque
+from multiprocessing import Pool
+from os.path import basename, isfile, join as pjoin
+from fontTools.misc.filenames import userNameToFileName
+from glyphsLib.classes import GSFont
+from glyphsLib.parser import Parser
+
+# Streaming reader for Glyphs package sources (.glyphspackage directories.)
+#
+# A package is a directory with fontinfo.plist (everything but the glyphs), order.plist
+# (the glyph order) and glyphs/*.glyph (one file per glyph.) glyphsLib and glyphspkg
+# read all glyph files into one big dict before doing anything with it, which for Inter
+# means holding every layer background and every archived copy of a master layer in
+# memory twice over, once as plist data and once as GSGlyph objects.
+#
+# GlyphsPackageReader instead parses glyph files one at a time, in glyph order, as they
+# are iterated over, and drops data which isn't used to build fonts right after parsing
+# each file:
+#
+#   - layer backgrounds and background images
+#   - layers which are not master layers, brace (intermediate master) layers or bracket
+#     (alternate) layers, e.g. "Apr 3 20" copies of master layers kept for reference
+#
+# This is the same data that "fontbuild glyphsync" removes from a fully loaded .glyphs
+# file, and which fontmake doesn't write to UFOs (it calls glyphsLib with minimal=True.)
+#
+# Pass strip=False to read glyphs as they are.
+#
+# With procs > 1, glyph files are parsed by a pool of worker processes, a few chunks of
+# files ahead of the consumer, and the glyphs are passed on in glyph order. When writing
+# a .glyphs file, workers also format the glyphs, so that all this process does is write
+# the text to the file.
+
+log = logging.getLogger(__name__)
+
+
+def isBuildLayer(layer, masterIds):
+  # True if layer (a layer dict of a .glyph file) is used to build fonts
+  if layer.get('layerId') in masterIds:
+    return True
+  name = layer.get('name', '')
+  if name.startswith('_'):
+    return False
+  attr = layer.get('attr', {})
+  if '{' in name or 'coordinates' in attr:  # brace layer
+    return True
+  if '[' in name or 'axisRules' in attr:  # bracket layer
+    return True
+  return False
+
+
+def stripGlyph(glyph, masterIds):
+  # Removes backgrounds and non-build layers from glyph (a .glyph file dict)
+  layers = []
+  for layer in glyph.get('layers', []):
+    if isBuildLayer(layer, masterIds):
+      layer.pop('background', None)
+      layer.pop('backgroundImage', None)
+      layers.append(layer)
+  glyph['layers'] = layers
+  return glyph
+
+
+def _loadPlist(filename):
+  with open(filename, 'r', encoding='utf-8') as f:
+    return openstep_plist.load(f, use_numbers=True)
+
+
+def _loadGlyphsProc(task):
+  # Loads glyph files. Runs in a worker process of GlyphsPackageReader, or in this
+  # process. Returns glyph dicts, or glyphs formatted as plist text if dump is true.
+  filenames, masterIds, dump = task
+  glyphs = []
+  for filename in filenames:
+    glyph = _loadPlist(filename)
+    if masterIds is not None:
+      stripGlyph(glyph, masterIds)
+    glyphs.append(_dumps(glyph) if dump else glyph)
+  return glyphs
+
+
+class GlyphsPackageReader(object):
+
+  def __init__(
+    self,
+    path,
+    strip=True,         # leave out backgrounds and layers not used to build fonts
+    procs=1,            # max number of processes to use. None = number of CPUs
+    minParallel=500,    # load glyphs in this process when fewer glyph files than this
+  ):
+    self.path = path
+    self.strip = strip
+    self.procs = procs
+    self.minParallel = minParallel
+    self._fontInfo = None
+    self._glyphFiles = None
+
+  def fontInfo(self):
+    # Returns the font dict of the package, without glyphs. Like glyphsLib, the editor
+    # state in UIState.plist (if any) is merged into it.
+    if self._fontInfo is None:
+      info = _loadPlist(pjoin(self.path, 'fontinfo.plist'))
+      uistateFile = pjoin(self.path, 'UIState.plist')
+      if isfile(uistateFile):
+        uistate = _loadPlist(uistateFile)
+        if 'displayStrings' in uistate and 'DisplayStrings' not in uistate:
+          uistate['DisplayStrings'] = uistate.pop('displayStrings')
+        info.update(uistate)
+      self._fontInfo = info
+    return self._fontInfo
+
+  def masterIds(self):
+    return set(m['id'] for m in self.fontInfo().get('fontMaster', []))
+
+  def glyphOrder(self):
+    orderFile = pjoin(self.path, 'order.plist')
+    if not isfile(orderFile):
+      return []
+    return _loadPlist(orderFile)
+
+  def glyphFiles(self):
+    # Returns paths of all glyph files, ordered like glyphsLib orders glyphs: glyphs
+    # listed in order.plist first, in that order, followed by other glyphs by name.
+    if self._glyphFiles is not None:
+      return self._glyphFiles
+    glyphsDir = pjoin(self.path, 'glyphs')
+    unclaimed = set(fn for fn in os.listdir(glyphsDir) if fn.endswith('.glyph'))
+    order = self.glyphOrder()
+    ordered = [None] * len(order)
+    orderIndex = {}
+    for i, name in enumerate(order):
+      orderIndex.setdefault(name, i)
+      fn = userNameToFileName(name) + '.glyph'
+      if fn in unclaimed:
+        unclaimed.remove(fn)
+        ordered[i] = fn
+    # Files which are not named the way we expect (e.g. glyph names which differ only in
+    # case) have to be parsed to find out which glyph they contain. This is rare.
+    unordered = []
+    for fn in sorted(unclaimed):
+      name = _loadPlist(pjoin(glyphsDir, fn)).get('glyphname')
+      i = orderIndex.get(name)
+      if i is not None and ordered[i] is None:
+        ordered[i] = fn
+      else:
+        unordered.append((name or '', fn))
+    unordered.sort()
+    files = [fn for fn in ordered if fn is not None] + [fn for _, fn in unordered]
+    self._glyphFiles = [pjoin(glyphsDir, fn) for fn in files]
+    return self._glyphFiles
+
+  def loadGlyph(self, filename):
+    masterIds = self.masterIds() if self.strip else None
+    return _loadGlyphsProc(([filename], masterIds, False))[0]
+
+  def glyphs(self):
+    # Yields glyph dicts in glyph order. Each glyph file is parsed only when its glyph
+    # is requested (or shortly before, when parsing in parallel.)
+    return self._loadGlyphs(dump=False)
+
+  def _loadGlyphs(self, dump):
+    masterIds = self.masterIds() if self.strip else None
+    filenames = self.glyphFiles()
+    procs = self.procs
+    if procs is None:
+      procs = os.cpu_count() or 1
+    if procs < 2 or len(filenames) < self.minParallel:
+      for filename in filenames:
+        yield _loadGlyphsProc(([filename], masterIds, dump))[0]
+      return
+    chunkSize = max(1, len(filenames) // (procs * 4))
+    chunks = [filenames[i:i + chunkSize] for i in range(0, len(filenames), chunkSize)]
+    with Pool(min(procs, len(chunks))) as pool:
+      # Results are consumed in order, and at most two chunks per process are loaded
+      # ahead of the consumer, which bounds memory use when the consumer is slower
+      # than the workers.
+      pending = deque()
+      for chunk in chunks:
+        pending.append(pool.apply_async(_loadGlyphsProc, ((chunk, masterIds, dump),)))
+        if len(pending) >= procs * 2:
+          for glyph in pending.popleft().get():
+            yield glyph
+      while pending:
+        for glyph in pending.popleft().get():
+          yield glyph
+
+  def font(self):
+    # Returns a glyphsLib GSFont, like glyphsLib.GSFont(path) does. Glyphs are turned
+    # into GSGlyph objects one at a time, so that the plist data of only a few glyphs is
+    # in memory at any time.
+    font = GSFont()
+    parser = Parser(current_type=GSFont)
+    parser.parse_into_object(font, self.fontInfo())
+    # The cyclic garbage collector would run over and over on the growing graph of
+    # glyph objects, none of which is garbage, taking most of the time.
+    gcEnabled = gc.isenabled()
+    gc.disable()
+    try:
+      for glyph in self.glyphs():
+        parser.parse_into_object(font, {'glyphs': [glyph]})
+    finally:
+      if gcEnabled:
+        gc.enable()
+    font.filepath = self.path
+    for master in font.masters:
+      master.font = font
+    return font
+
+  def writeGlyphsFile(self, filename):
+    # Writes the package as a single .glyphs file, like glyphspkg does.
+    # Glyphs are written as they are read, one at a time.
+    info = self.fontInfo()
+    head = dict((k, v) for k, v in info.items() if k < 'glyphs')
+    tail = dict((k, v) for k, v in info.items() if k > 'glyphs')
+    tmpfile = filename + '.tmp'
+    with open(tmpfile, 'w', encoding='utf-8') as f:
+      f.write('{\n')
+      f.write(_dumpEntries(head))
+      f.write('glyphs = (\n')
+      sep = ''
+      for text in self._loadGlyphs(dump=True):
+        f.write(sep)
+        f.write(text)
+        sep = ',\n'
+      f.write('\n);\n')
+      f.write(_dumpEntries(tail))
+      f.write('}')
+    os.replace(tmpfile, filename)
+    log.info('wrote %s (%d glyphs)', basename(filename), len(self.glyphFiles()))
+
+
+def _dumps(obj):
+  # same format as written by Glyphs and glyphspkg
+  return openstep_plist.dumps(
+    obj,
+    unicode_escape=False,
+    indent=0,
+    single_line_tuples=True,
+    escape_newlines=False,
+  )
+
+
+def _dumpEntries(d):
+  # "key = value;" lines of dict d, without the enclosing braces
+  if not d:
+    return ''
+  s = _dumps(d)
+  assert s.startswith('{\n') and s.endswith('}')
+  return s[2:-1]
@@ -0,0 +1,200 @@
+import os
+import logging
+from multiprocessing import Pool
+from os.path import basename, normpath, splitext
+from fontTools.designspaceLib import DesignSpaceDocument
+from fontTools.designspaceLib.split import splitInterpolable
+from fontmake import instantiator
+from glyphsLib.interpolation import apply_instance_data_to_ufo
+from postprocess_instance_ufo import fix_instance_info
+from .ufo import saveUFOIncremental
+from . import interpolate
+
+# Generates instance UFOs from a designspace.
+#
+# Unlike running "fontmake -o ufo -i <instance>" once per instance, the designspace and
+# its masters are loaded once and the interpolation model of each glyph is built once.
+# Instances are then generated in parallel by worker processes, which inherit the loaded
+# masters and models from the parent process (when processes are forked.)
+#
+# When numpy is available, glyphs are interpolated with the vectorized engine in
+# interpolate.py and the glyphs of all instances to be generated are computed up front
+# in the parent process.
+#
+# Advance widths of instances are rounded to integers (see roundAdvanceWidths.) The
+# vectorized engine rounds them as it interpolates, so that only glyphs which it didn't
+# interpolate are left to round afterwards.
+#
+# Instance UFOs are updated in place with saveUFOIncremental, so regenerating instances
+# after editing a few glyphs only rewrites the .glif files of glyphs which changed.
+
+log = logging.getLogger(__name__)
+
+
+class InstanceGenerator:
+
+  def __init__(self,
+    designspace,          # designspace filename string or DesignSpaceDocument object
+    roundGeometry=False,  # round coordinates to integers
+    vectorize=None,       # use numpy interpolation engine. None = if numpy is available
+  ):
+    if isinstance(designspace, str):
+      designspace = DesignSpaceDocument.fromfile(designspace)
+    self.designspace = designspace
+    self.roundGeometry = roundGeometry
+    if vectorize is None:
+      vectorize = interpolate.available()
+    elif vectorize and not interpolate.available():
+      raise ImportError('numpy is required for vectorized interpolation')
+    self.vectorize = vectorize
+    self._subDocs = [subDoc for _, subDoc in splitInterpolable(designspace)]
+    self._instantiators = [None] * len(self._subDocs)
+
+
+  def findInstances(self, names=None):
+    # Returns a list of (instanceID, InstanceDescriptor) for the instances matching names.
+    # names can be instance names (e.g. "Inter Display Bold"), which are matched
+    # case-insensitively, or UFO file names (e.g. "InterDisplay-Bold".)
+    # Instances which are masters (i.e. their UFO file is a source UFO) are excluded
+    # unless explicitly named. If names is empty or None, all instances are returned.
+    # Raises KeyError if a name does not match any instance.
+    sourcePaths = set(normpath(s.path) for s in self.designspace.sources if s.path)
+    unmatched = None
+    if names:
+      unmatched = set(names)
+    found = []
+    for docIndex, subDoc in enumerate(self._subDocs):
+      for instanceIndex, instance in enumerate(subDoc.instances):
+        # skip instances that have been set to non-export in Glyphs
+        if not instance.lib.get('com.schriftgestaltung.export', True):
+          continue
+        instanceID = (docIndex, instanceIndex)
+        if unmatched is None:
+          if instance.path and normpath(instance.path) in sourcePaths:
+            continue
+          found.append((instanceID, instance))
+          continue
+        for name in names:
+          if self._instanceMatchesName(instance, name):
+            unmatched.discard(name)
+            found.append((instanceID, instance))
+            break
+    if unmatched:
+      raise KeyError('unknown instance(s): %s' % ', '.join(sorted(unmatched)))
+    return found
+
+
+  def _instanceMatchesName(self, instance, name):
+    if instance.name and instance.name.lower() == name.lower():
+      return True
+    if instance.filename:
+      return splitext(basename(instance.filename))[0] == name
+    return False
+
+
+  def _instantiator(self, docIndex):
+    gen = self._instantiators[docIndex]
+    if gen is None:
+      log.info('loading masters of %s', self.designspace.path)
+      gen = instantiator.Instantiator.from_designspace(
+        self._subDocs[docIndex], round_geometry=self.roundGeometry)
+      self._instantiators[docIndex] = gen
+    return gen
+
+
+  def prepare(self, instanceIDs):
+    # Loads masters and, when vectorize is enabled, interpolates the glyphs of all
+    # instanceIDs at once. Calling this is optional; generate calls it as needed.
+    locations = {}  # docIndex => [location]
+    for docIndex, instanceIndex in instanceIDs:
+      instance = self._subDocs[docIndex].instances[instanceIndex]
+      locations.setdefault(docIndex, []).append(instance.location)
+    for docIndex, locs in locations.items():
+      if self._instantiators[docIndex] is not None:
+        continue
+      gen = self._instantiator(docIndex)
+      if self.vectorize:
+        interpolate.packGlyphVariators(
+          gen, self._subDocs[docIndex], locs, roundAdvances=True)
+
+
+  def generate(self, instanceID):
+    # Returns a new UFO font object for the instance
+    docIndex, instanceIndex = instanceID
+    subDoc = self._subDocs[docIndex]
+    instance = subDoc.instances[instanceIndex]
+    self.prepare([instanceID])
+    gen = self._instantiators[docIndex]
+    log.info('generating instance %r', instance.name)
+    ufo = gen.generate_instance(instance)
+    apply_instance_data_to_ufo(ufo, instance, subDoc)
+    roundAdvanceWidths(ufo)
+    fix_instance_info(ufo)
+    return ufo
+
+
+  def generateFile(self, instanceID, outputPath):
+    ufo = self.generate(instanceID)
+    nwritten = saveUFOIncremental(ufo, outputPath)
+    log.debug('wrote %s (%d glyphs updated)', outputPath, nwritten)
+    return outputPath
+
+
+  def generateFiles(self,
+    jobs,          # list of (instanceID, outputPath)
+    procs=None,    # max number of processes to use. None = number of CPUs
+    onFile=None,   # optional function called with outputPath after each file is written
+  ):
+    global _procGenerator
+    if len(jobs) == 0:
+      return
+    self.prepare([instanceID for instanceID, _ in jobs])
+    # Generate the first instance in this process. As a side effect this builds the
+    # interpolation models for all glyphs, which are then inherited by (not rebuilt in)
+    # forked worker processes.
+    self._generated(self.generateFile(*jobs[0]), onFile)
+    jobs = jobs[1:]
+    if procs is None:
+      procs = os.cpu_count() or 1
+    procs = min(procs, len(jobs))
+    if procs < 2:
+      for job in jobs:
+        self._generated(self.generateFile(*job), onFile)
+      return
+    _procGenerator = self
+    try:
+      initargs = (self.designspace.path, self.roundGeometry, self.vectorize)
+      with Pool(procs, _initProc, initargs) as pool:
+        for outputPath in pool.imap_unordered(_generateFileProc, jobs):
+          self._generated(outputPath, onFile)
+    finally:
+      _procGenerator = None
+
+
+  def _generated(self, outputPath, onFile):
+    if onFile is not None:
+      onFile(outputPath)
+
+
+def roundAdvanceWidths(ufo):
+  # Rounds fractional advance widths to integers.
+  # See https://github.com/rsms/inter/issues/508
+  # TODO: Remove when https://github.com/googlefonts/glyphsLib/issues/821 is fixed
+  for g in ufo:
+    if type(g.width) is not int:
+      g.width = int(round(g.width))
+
+
+# worker process state
+_procGenerator = None
+
+
+def _initProc(designspacePath, roundGeometry, vectorize):
+  global _procGenerator
+  if _procGenerator is None:
+    # process was not forked (e.g. "spawn" start method); load designspace anew
+    _procGenerator = InstanceGenerator(designspacePath, roundGeometry, vectorize)
+
+
+def _generateFileProc(job):
+  return _procGenerator.generateFile(*job)
@@ -0,0 +1,297 @@
+import copy
+import logging
+from fontTools.varLib.models import VariationModel, normalizeLocation
+from fontTools.pens.pointPen import AbstractPointPen
+from fontTools.misc.roundTools import otRound
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+# Vectorized glyph interpolation for fontmake's Instantiator.
+#
+# fontmake's Instantiator interpolates each glyph of each instance with fontMath, one
+# point at a time in Python objects. Since interpolation is linear, an instance of a
+# glyph is just a weighted sum of the glyph's masters, where the weights depend only on
+# the location of the instance. So, for masters that are point-for-point compatible, we:
+#
+# 1. pack the numbers of each glyph of each master (advance, point coordinates,
+#    component transforms and anchor positions) into one row per master;
+# 2. compute a row of master weights for each instance location; and
+# 3. multiply the weights (instances x masters) with the packed master values
+#    (masters x numbers of all glyphs) in a single matrix product.
+#
+# Advance widths can optionally be rounded to integers, as one vectorized operation on
+# the advance columns of the interpolated values.
+#
+# Results are handed to the Instantiator by replacing its per-glyph "Variator" objects
+# with PackedGlyphVariator objects, which have the same interface. Glyphs which are not
+# compatible across masters (or which use features we don't pack, like guidelines and
+# images) are left to the Instantiator and fontMath.
+#
+# Requires numpy. Check "available()" before use.
+
+log = logging.getLogger(__name__)
+
+
+def available():
+  return numpy is not None
+
+
+class _PackingPointPen(AbstractPointPen):
+  # Records the structure and the numbers of a glyph's outline
+  def __init__(self, values):
+    self.values = values
+    self.contours = []
+    self.components = []
+    self._points = None
+
+  def beginPath(self, identifier=None, **kwargs):
+    self._points = []
+    self.contours.append((identifier, self._points))
+
+  def endPath(self):
+    self._points = None
+
+  def addPoint(self, pt, segmentType=None, smooth=False, name=None, identifier=None,
+               **kwargs):
+    self._points.append((segmentType, smooth, name, identifier))
+    self.values += pt
+
+  def addComponent(self, baseGlyphName, transformation, identifier=None, **kwargs):
+    self.components.append((baseGlyphName, identifier))
+    self.values += transformation
+
+
+class _GlyphTemplate:
+  # Everything about a glyph except the numbers, taken from the default master
+
+  def __init__(self, glyph, pen):
+    self.contours = tuple(
+      (identifier, tuple(points)) for identifier, points in pen.contours)
+    self.components = tuple(pen.components)
+    self.anchors = tuple((a.name, a.color, a.identifier) for a in glyph.anchors)
+    self.lib = copy.deepcopy(dict(glyph.lib))
+    self.note = glyph.note
+    # roundable[i] is False for values which should not be rounded (component scale)
+    roundable = [True] * (2 + 2 * sum(len(points) for _, points in self.contours))
+    for _ in self.components:
+      roundable += (False, False, False, False, True, True)
+    roundable += [True, True] * len(self.anchors)
+    self.roundable = roundable
+
+
+  def isCompatible(self, glyph, pen):
+    # True if glyph (of another master) can be interpolated with this template
+    if len(pen.contours) != len(self.contours):
+      return False
+    for (_, points), (_, otherPoints) in zip(self.contours, pen.contours):
+      if len(points) != len(otherPoints):
+        return False
+      for p1, p2 in zip(points, otherPoints):
+        if p1[0] != p2[0]:  # segmentType
+          return False
+    if [c[0] for c in self.components] != [c[0] for c in pen.components]:
+      return False
+    return [a[0] for a in self.anchors] == [a.name for a in glyph.anchors]
+
+
+def _packGlyph(glyph):
+  # Returns (pen, values) or (None, None) if glyph can't be packed
+  if glyph.guidelines or getattr(glyph.image, 'fileName', None):
+    return None, None
+  values = [glyph.width, glyph.height]
+  pen = _PackingPointPen(values)
+  glyph.drawPoints(pen)
+  for a in glyph.anchors:
+    values += (a.x, a.y)
+  return pen, values
+
+
+class PackedGlyphInstance:
+  # Same interface as fontMath's MathGlyph, as used by fontmake's Instantiator
+
+  def __init__(self, template, values):
+    self.template = template
+    self.values = values  # list of numbers
+
+
+  def round(self):
+    values = [otRound(v) if r else v for v, r in zip(self.values, self.template.roundable)]
+    return PackedGlyphInstance(self.template, values)
+
+
+  def extractGlyph(self, glyph, pointPen=None, onlyGeometry=False):
+    t = self.template
+    values = self.values
+    glyph.clearContours()
+    glyph.clearComponents()
+    glyph.clearAnchors()
+    glyph.lib.clear()
+    if pointPen is None:
+      pointPen = glyph.getPointPen()
+    glyph.width = values[0]
+    glyph.height = values[1]
+    i = 2
+    for identifier, points in t.contours:
+      pointPen.beginPath(identifier=identifier)
+      for segmentType, smooth, name, pointIdentifier in points:
+        pointPen.addPoint(
+          (values[i], values[i + 1]), segmentType, smooth, name, pointIdentifier)
+        i += 2
+      pointPen.endPath()
+    for baseGlyph, identifier in t.components:
+      pointPen.addComponent(baseGlyph, tuple(values[i:i + 6]), identifier=identifier)
+      i += 6
+    for name, color, identifier in t.anchors:
+      anchor = dict(x=values[i], y=values[i + 1], name=name)
+      if color is not None:
+        anchor['color'] = color
+      if identifier is not None:
+        anchor['identifier'] = identifier
+      glyph.appendAnchor(anchor)
+      i += 2
+    glyph.lib.update(copy.deepcopy(t.lib))
+    glyph.note = t.note
+    return glyph
+
+
+class PackedGlyphVariator:
+  # Same interface as fontmake's instantiator.Variator
+
+  def __init__(self, packedMasters, template, start, end):
+    self.packedMasters = packedMasters
+    self.template = template
+    self.start = start  # range of this glyph's columns in packedMasters
+    self.end = end
+
+
+  def instance_at(self, normalizedLocation):
+    return PackedGlyphInstance(
+      self.template, self.packedMasters.valuesAt(normalizedLocation, self.start, self.end))
+
+
+class PackedMasters:
+  # Values of all glyphs of all masters, packed into a (masters x values) matrix
+
+  def __init__(self, masterLocations, axisOrder, roundAdvances=False):
+    self.model = VariationModel(masterLocations, axisOrder)
+    self.masterLocationKeys = [_locationKey(loc) for loc in masterLocations]
+    self.masterValues = [[] for _ in masterLocations]  # rows, until finalize()
+    self.matrix = None
+    self.roundAdvances = roundAdvances
+    self.advanceColumns = []  # column of the advance width of each glyph
+    self._instances = {}  # location key => row of interpolated values
+
+
+  def add(self, valuesPerMaster):
+    # Adds the values of one glyph. Returns its (start, end) column range.
+    start = len(self.masterValues[0])
+    for row, values in zip(self.masterValues, valuesPerMaster):
+      row += values
+    self.advanceColumns.append(start)
+    return start, len(self.masterValues[0])
+
+
+  def finalize(self):
+    self.matrix = numpy.array(self.masterValues, dtype=numpy.float64)
+
+
+  def interpolate(self, normalizedLocations):
+    # Computes values of all glyphs at all locations in one matrix product
+    locations = []
+    weights = []
+    for loc in normalizedLocations:
+      key = _locationKey(loc)
+      if key in self._instances or key in self.masterLocationKeys:
+        continue
+      locations.append(key)
+      weights.append(self.model.getMasterScalars(loc))
+    if len(weights) == 0:
+      return
+    result = numpy.array(weights, dtype=numpy.float64) @ self.matrix
+    if self.roundAdvances and self.advanceColumns:
+      # round half to even, like round()
+      columns = numpy.array(self.advanceColumns)
+      result[:, columns] = numpy.round(result[:, columns])
+    for key, row in zip(locations, result):
+      self._instances[key] = row.tolist()
+
+
+  def valuesAt(self, normalizedLocation, start, end):
+    key = _locationKey(normalizedLocation)
+    if key in self.masterLocationKeys:
+      # exact master values (same as the Instantiator does)
+      values = list(self.masterValues[self.masterLocationKeys.index(key)][start:end])
+    else:
+      if key not in self._instances:
+        self.interpolate([normalizedLocation])
+      values = self._instances[key][start:end]
+    if self.roundAdvances:
+      values[0] = int(round(values[0]))  # already rounded when interpolated
+    return values
+
+
+def _locationKey(location):
+  return tuple(sorted((k, v) for k, v in location.items() if v != 0))
+
+
+def normalizeInstanceLocation(instantiator, location):
+  # Returns normalized location, with unspecified axes at their default
+  defaultLocation = {
+    axis: default for axis, (_, default, _) in instantiator.axis_bounds.items()}
+  return normalizeLocation({**defaultLocation, **location}, instantiator.axis_bounds)
+
+
+def packGlyphVariators(
+  instantiator,  # fontmake.instantiator.Instantiator
+  designspace,   # DesignSpaceDocument the instantiator was made from
+  locations,     # design-space locations (dicts) of instances to precompute
+  roundAdvances=False,  # round advance widths to integers
+):
+  # Replaces the glyph Variators of instantiator with PackedGlyphVariators for all
+  # glyphs which are compatible across masters, and interpolates them at locations.
+  # Returns the number of glyphs packed.
+  sources = designspace.sources
+  layers = []
+  for source in sources:
+    if source.layerName is None:
+      layers.append(source.font.layers.defaultLayer)
+    else:
+      layers.append(source.font.layers[source.layerName])
+  defaultIndex = sources.index(designspace.findDefault())
+  masterLocations = [
+    normalizeInstanceLocation(instantiator, source.location) for source in sources]
+  packedMasters = PackedMasters(
+    masterLocations, list(instantiator.axis_bounds.keys()), roundAdvances)
+
+  variators = {}
+  for glyphName in layers[defaultIndex].keys():
+    pens = []
+    valuesPerMaster = []
+    for layer in layers:
+      if glyphName not in layer:
+        break
+      pen, values = _packGlyph(layer[glyphName])
+      if pen is None:
+        break
+      pens.append(pen)
+      valuesPerMaster.append(values)
+    if len(pens) != len(layers):
+      continue
+    defaultGlyph = layers[defaultIndex][glyphName]
+    template = _GlyphTemplate(defaultGlyph, pens[defaultIndex])
+    if not all(template.isCompatible(layer[glyphName], pen)
+               for layer, pen in zip(layers, pens)):
+      log.debug('not packing incompatible glyph %r', glyphName)
+      continue
+    start, end = packedMasters.add(valuesPerMaster)
+    variators[glyphName] = PackedGlyphVariator(packedMasters, template, start, end)
+
+  packedMasters.finalize()
+  packedMasters.interpolate(
+    [normalizeInstanceLocation(instantiator, loc) for loc in locations])
+  instantiator.glyph_mutators.update(variators)
+  log.info('interpolated %d glyphs at %d locations', len(variators), len(locations))
+  return len(variators)
@@ -0,0 +1,221 @@
+import os
+import logging
+from multiprocessing import Pool
+from os.path import join as pjoin
+from fontTools.pens.pointPen import AbstractPointPen, PointToSegmentPen, SegmentToPointPen
+from ufo2ft.filters.removeOverlaps import RemoveOverlapsFilter
+from .cache import DEFAULT_CACHE_DIR, SqliteCache
+
+# Overlap removal with a persistent cache of results.
+#
+# Removing overlaps with Skia pathops is one of the most expensive steps of a build, and
+# it's done for the same, unchanged outlines on every build. OverlapCache maps a digest
+# of a glyph's contours to the contours with overlaps removed, so that only glyphs which
+# have been edited since the last build need to be run through pathops.
+#
+# The cache is a sqlite database at build/cache/overlaps.db which can be shared by
+# concurrent processes.
+#
+# removeOverlaps removes overlaps in many glyphs (e.g. of all masters of a designspace)
+# in parallel, in a pool of worker processes.
+
+log = logging.getLogger(__name__)
+
+DEFAULT_OVERLAP_CACHE_FILE = pjoin(DEFAULT_CACHE_DIR, 'overlaps.db')
+
+# Bump this to invalidate all existing cache entries
+OVERLAP_CACHE_FORMAT_VERSION = 1
+
+
+class _ContourRecorder(AbstractPointPen):
+  # Records contours as [[(x, y, segmentType, smooth), ...], ...]. Ignores components.
+  def __init__(self):
+    self.contours = []
+
+  def beginPath(self, identifier=None, **kwargs):
+    self.contours.append([])
+
+  def endPath(self):
+    pass
+
+  def addPoint(self, pt, segmentType=None, smooth=False, name=None, identifier=None,
+               **kwargs):
+    self.contours[-1].append((float(pt[0]), float(pt[1]), segmentType, bool(smooth)))
+
+  def addComponent(self, baseGlyphName, transformation, identifier=None, **kwargs):
+    pass
+
+
+def glyphContours(glyph):
+  pen = _ContourRecorder()
+  glyph.drawPoints(pen)
+  return pen.contours
+
+
+def setGlyphContours(glyph, contours):
+  # Replaces the contours of glyph with contours returned by glyphContours
+  hold = getattr(glyph, 'holdNotifications', None)  # defcon
+  if hold is not None:
+    hold()
+  glyph.clearContours()
+  pen = glyph.getPointPen()
+  for contour in contours:
+    pen.beginPath()
+    for x, y, segmentType, smooth in contour:
+      pen.addPoint((x, y), segmentType, smooth)
+    pen.endPath()
+  if hold is not None:
+    glyph.releaseHeldNotifications()
+
+
+class OverlapCache(SqliteCache):
+  # Maps digests of glyph contours to the contours with overlaps removed
+  TABLE = 'overlaps'
+  COLUMN = 'contours'
+  FORMAT_VERSION = OVERLAP_CACHE_FORMAT_VERSION
+  KEY_TOOLS = ('skia-pathops', 'ufo2ft')
+
+
+  def __init__(self, filename=DEFAULT_OVERLAP_CACHE_FILE):
+    super().__init__(filename)
+    self._pending = []  # [(key, contours)] not yet written to the database
+
+
+  def key(self, contours):
+    h = self._hash()
+    h.update(repr(contours).encode('utf-8'))
+    return h.hexdigest()
+
+
+  def put(self, key, contours):
+    self._connection()  # in a forked process, drops the parent's entries first
+    self._pending.append((key, contours))
+    if len(self._pending) >= 1000:
+      self.flush()
+
+
+  def flush(self):
+    if len(self._pending) == 0:
+      return
+    self._insert(self._pending)
+    log.debug('stored %d entries in %s', len(self._pending), self.filename)
+    self._pending = []
+
+
+  def _forked(self):
+    self._pending = []  # parent's entries; stored by the parent
+
+
+class CachedRemoveOverlapsFilter(RemoveOverlapsFilter):
+  # RemoveOverlapsFilter which looks up results in an OverlapCache before running
+  # pathops. Takes the same arguments as RemoveOverlapsFilter plus "cache"; an
+  # OverlapCache object or None, in which case this is just a RemoveOverlapsFilter.
+  _kwargs = dict(RemoveOverlapsFilter._kwargs, cache=None)
+
+
+  def filter(self, glyph):
+    cache = self.options.cache
+    if cache is None or not len(glyph):
+      return super().filter(glyph)
+    key = cache.key(glyphContours(glyph))
+    contours = cache.get(key)
+    if contours is not None:
+      setGlyphContours(glyph, contours)
+      return True
+    modified = super().filter(glyph)
+    cache.put(key, glyphContours(glyph))
+    return modified
+
+
+  def __call__(self, font, glyphSet=None):
+    try:
+      return super().__call__(font, glyphSet)
+    finally:
+      if self.options.cache is not None:
+        self.options.cache.flush()
+
+
+class _RecordedContour:
+  # Contour returned by glyphContours, drawable like a defcon or ufoLib2 contour
+  __slots__ = ('points',)
+
+  def __init__(self, points):
+    self.points = points
+
+  def draw(self, pen):
+    self.drawPoints(PointToSegmentPen(pen))
+
+  def drawPoints(self, pointPen):
+    pointPen.beginPath()
+    for x, y, segmentType, smooth in self.points:
+      pointPen.addPoint((x, y), segmentType, smooth)
+    pointPen.endPath()
+
+
+def _unionContours(contours):
+  # Returns contours (as returned by glyphContours) with overlaps removed, the same as
+  # RemoveOverlapsFilter(backend='pathops') does to a glyph.
+  from pathops import union
+  recorder = _ContourRecorder()
+  union([_RecordedContour(c) for c in contours], SegmentToPointPen(recorder))
+  return recorder.contours
+
+
+def _removeOverlapsProc(chunk):
+  # Runs in a worker process of removeOverlaps
+  from pathops import PathOpsError
+  results = []
+  for name, contours in chunk:
+    try:
+      results.append(_unionContours(contours))
+    except (PathOpsError, ValueError, TypeError) as e:
+      raise Exception('failed to remove overlaps for %s: %s' % (name, e))
+  return results
+
+
+def removeOverlaps(
+  glyphs,             # glyph objects, possibly of several fonts
+  cache=None,         # OverlapCache or None
+  procs=None,         # max number of processes to use. None = number of CPUs
+  minParallel=100,    # remove overlaps in this process when fewer glyphs than this
+):
+  # Removes overlaps in glyphs, distributing the work across a pool of processes.
+  # Only contours are sent to worker processes (not glyph objects) and results are
+  # written back to the glyphs in this process.
+  jobs = []  # [(glyph, contours, cache key)]
+  ncached = 0
+  for glyph in glyphs:
+    if not len(glyph):
+      continue
+    contours = glyphContours(glyph)
+    key = None
+    if cache is not None:
+      key = cache.key(contours)
+      cached = cache.get(key)
+      if cached is not None:
+        setGlyphContours(glyph, cached)
+        ncached += 1
+        continue
+    jobs.append((glyph, contours, key))
+
+  if procs is None:
+    procs = os.cpu_count() or 1
+  tasks = [(glyph.name, contours) for glyph, contours, _ in jobs]
+  if procs < 2 or len(tasks) < minParallel:
+    results = _removeOverlapsProc(tasks)
+  else:
+    # a few chunks per process evens out differences in glyph complexity
+    chunkSize = max(1, len(tasks) // (procs * 4))
+    chunks = [tasks[i:i + chunkSize] for i in range(0, len(tasks), chunkSize)]
+    results = []
+    with Pool(min(procs, len(chunks))) as pool:
+      for chunkResults in pool.imap(_removeOverlapsProc, chunks):
+        results += chunkResults
+
+  for (glyph, _, key), contours in zip(jobs, results):
+    setGlyphContours(glyph, contours)
+    if cache is not None:
+      cache.put(key, contours)
+  if cache is not None:
+    cache.flush()
+  log.debug('removed overlaps in %d glyphs (%d cached)', len(jobs) + ncached, ncached)
@@ -0,0 +1,337 @@
+import os
+import io
+import sys
+import json
+import time
+import socket
+import signal
+import hashlib
+import logging
+import selectors
+import traceback
+from collections import OrderedDict
+from defcon import Font
+
+# fontbuild server, for running many fontbuild commands without paying for Python
+# startup, imports and source parsing each time.
+#
+# "fontbuild serve" listens on a Unix socket. misc/fontbuild-client, a small script which
+# only imports the standard library, sends its command line, working directory,
+# environment and stdio file descriptors to the server, which forks a process that runs
+# the command as if it was "fontbuild" started by the client, writing directly to the
+# client's stdout and stderr. The exit status is sent back to the client, which exits
+# with it. When no server is running the client runs misc/fontbuild itself, so the
+# server is purely an optimization.
+#
+# Forked processes start with all modules which fontbuild uses already imported and
+# initialized. They also share the server's cache of loaded UFOs: loadFont() returns
+# the server's copy of a UFO when the UFO hasn't changed since the server loaded it,
+# which is very cheap as the forked process' memory is a copy-on-write copy of the
+# server's. UFOs which a forked process had to load from disk are reported back to the
+# server (over a pipe), which loads them itself once it's idle, so that the next
+# command reading the same UFO (e.g. when rebuilding a font after editing its features)
+# doesn't have to.
+#
+# Changes to the code of fontbuild (watchFiles) while a server is running make it stop
+# accepting requests and return from serve(), so that it can be restarted. Clients whose
+# connection is closed without their command being started run the command themselves.
+#
+# Protocol, client to server: one byte carrying the client's stdin, stdout and stderr
+# (SCM_RIGHTS), followed by a JSON object {"argv", "cwd", "env"} and a newline.
+# Server to client: JSON lines {"pid": <pid of forked process>} and, when the command
+# has finished, {"exit": <exit status>}. The forked process leads a new process group,
+# which the client forwards SIGINT, SIGTERM and SIGHUP to.
+
+log = logging.getLogger(__name__)
+
+SOCKET_ENV_VAR = 'FONTBUILD_SOCKET'
+DEFAULT_SOCKET = os.path.join(
+  os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+  'build', 'fontbuild.sock')
+
+# modules which are imported lazily by fontbuild commands and its dependencies
+_WARM_MODULES = [
+  'ufoLib2',
+  'ufo2ft.featureCompiler',
+  'ufo2ft.featureWriters.kernFeatureWriter',
+  'ufo2ft.featureWriters.markFeatureWriter',
+  'ufo2ft.featureWriters.gdefFeatureWriter',
+  'ufo2ft.instructionCompiler',
+  'fontTools.feaLib.builder',
+  'fontTools.otlLib.builder',
+  'fontTools.cffLib',
+  'fontTools.cffLib.specializer',
+  'fontTools.varLib',
+  'fontTools.varLib.instancer',
+  'fontTools.ttLib.woff2',
+  'fontTools.subset',
+  'glyphsLib.builder',
+]
+
+# tables which fontTools loads the modules of on first use
+_WARM_TABLES = [
+  'head', 'hhea', 'maxp', 'OS/2', 'hmtx', 'cmap', 'name', 'post', 'glyf', 'loca', 'CFF ',
+  'CFF2', 'GDEF', 'GSUB', 'GPOS', 'STAT', 'fvar', 'gvar', 'avar', 'HVAR', 'MVAR', 'DSIG',
+]
+
+# set in processes forked by the server
+_fonts = None        # path => (signature, Font), loaded by the server
+_hintFile = None     # file descriptor to report loaded UFO paths to the server on
+
+
+def defaultSocket():
+  return os.environ.get(SOCKET_ENV_VAR) or DEFAULT_SOCKET
+
+
+def _ufoSignature(path):
+  # Digest of names, sizes and modification times of all files of the UFO at path
+  h = hashlib.sha1()
+  for dirpath, dirnames, filenames in os.walk(path):
+    dirnames.sort()
+    for name in sorted(filenames):
+      filename = os.path.join(dirpath, name)
+      st = os.stat(filename)
+      h.update(('%s\0%d\0%d\0' % (filename, st.st_size, st.st_mtime_ns)).encode('utf-8'))
+  return h.hexdigest()
+
+
+def loadFont(path):
+  # Returns a defcon Font for the UFO at path. In a process forked by the server, this is
+  # the server's copy of the UFO, if it has one that is up to date.
+  if _fonts is None:
+    return Font(path)
+  path = os.path.abspath(path)
+  entry = _fonts.get(path)
+  if entry is not None and entry[0] == _ufoSignature(path):
+    log.debug('using preloaded %s', path)
+    return entry[1]
+  if _hintFile is not None:
+    try:
+      os.write(_hintFile, (path + '\n').encode('utf-8'))
+    except OSError:
+      pass
+  return Font(path)
+
+
+def _loadFontFully(path):
+  font = Font(path)
+  font.info, font.kerning, font.groups, font.features, font.lib
+  for layer in font.layers:
+    for glyph in layer:
+      pass
+  return font
+
+
+class Server:
+
+  def __init__(self,
+    socketPath,          # path of Unix socket to listen on
+    run,                 # function(argv) which runs a command in a forked process
+    idleTimeout=None,    # exit after this many seconds without requests. None = never
+    maxFonts=16,         # max number of UFOs to keep loaded
+    watchFiles=[],       # stop serving when any of these files change
+  ):
+    self.socketPath = socketPath
+    self.watchFiles = watchFiles
+    self.run = run
+    self.idleTimeout = idleTimeout
+    self.maxFonts = maxFonts
+    self.fonts = OrderedDict()  # path => (signature, Font), least recently used first
+    self.hints = OrderedDict()  # paths of UFOs to load when idle
+    self.lastRequestTime = time.monotonic()
+    self.sock = None
+    self.hintWrite = None
+
+  def warmUp(self):
+    import importlib
+    from fontTools.ttLib import getTableClass
+    for name in _WARM_MODULES:
+      try:
+        importlib.import_module(name)
+      except ImportError as e:
+        log.debug('not preloading %s: %s', name, e)
+    for tag in _WARM_TABLES:
+      getTableClass(tag)
+
+  def _watchSignature(self):
+    signature = []
+    for filename in self.watchFiles:
+      try:
+        st = os.stat(filename)
+        signature.append((st.st_size, st.st_mtime_ns))
+      except OSError:
+        signature.append(None)
+    return signature
+
+  def serve(self):
+    # Serves requests until the idle timeout expires (returns False) or a watched file
+    # changes (returns True)
+    if os.path.exists(self.socketPath):
+      if _isListening(self.socketPath):
+        raise Exception('a server is already listening on %s' % self.socketPath)
+      os.unlink(self.socketPath)
+    os.makedirs(os.path.dirname(self.socketPath) or '.', exist_ok=True)
+
+    self.warmUp()
+    watchSignature = self._watchSignature()
+
+    sock = self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(self.socketPath)
+    sock.listen(64)
+    hintRead, self.hintWrite = os.pipe()
+    os.set_blocking(hintRead, False)
+    hintBuf = b''
+
+    # forked processes are reaped automatically
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+    sel = selectors.DefaultSelector()
+    sel.register(sock, selectors.EVENT_READ)
+    sel.register(hintRead, selectors.EVENT_READ)
+    log.info('listening on %s', self.socketPath)
+    try:
+      while True:
+        events = sel.select(timeout=0.5)
+        for key, _ in events:
+          if key.fileobj is sock:
+            conn, _ = sock.accept()
+            self.lastRequestTime = time.monotonic()
+            if self._watchSignature() != watchSignature:
+              log.info('code changed; restarting')
+              conn.close()
+              return True
+            try:
+              self._handle(conn)
+            except Exception as e:
+              log.error('failed to handle request: %s', e)
+            finally:
+              conn.close()
+          else:
+            try:
+              hintBuf += os.read(hintRead, 65536)
+            except BlockingIOError:
+              pass
+            lines = hintBuf.split(b'\n')
+            hintBuf = lines.pop()
+            for line in lines:
+              path = line.decode('utf-8')
+              self.hints.pop(path, None)
+              self.hints[path] = None
+        if len(events) == 0:
+          self._idle()
+          if (self.idleTimeout is not None and
+              time.monotonic() - self.lastRequestTime > self.idleTimeout):
+            log.info('exiting after %ds without requests', self.idleTimeout)
+            return False
+    finally:
+      sel.close()
+      sock.close()
+      try:
+        os.unlink(self.socketPath)
+      except OSError:
+        pass
+
+  def _idle(self):
+    # Loads one of the UFOs which forked processes have reported loading
+    if len(self.hints) == 0 or self.maxFonts < 1:
+      return
+    path, _ = self.hints.popitem(last=True)
+    if not os.path.isdir(path):
+      return
+    signature = _ufoSignature(path)
+    entry = self.fonts.pop(path, None)
+    if entry is None or entry[0] != signature:
+      log.info('loading %s', path)
+      try:
+        entry = (signature, _loadFontFully(path))
+      except Exception as e:
+        log.warning('failed to load %s: %s', path, e)
+        return
+    self.fonts[path] = entry
+    while len(self.fonts) > self.maxFonts:
+      self.fonts.popitem(last=False)
+
+  def _handle(self, conn):
+    msg, fds, _, _ = socket.recv_fds(conn, 1, 3)
+    if len(msg) == 0 and len(fds) == 0:
+      return  # connection closed without a request, e.g. by _isListening
+    if len(fds) != 3:
+      for fd in fds:
+        os.close(fd)
+      raise Exception('expected 3 file descriptors, got %d' % len(fds))
+    try:
+      request = json.loads(conn.makefile('rb').readline())
+      sys.stdout.flush()
+      sys.stderr.flush()
+      pid = os.fork()
+      if pid == 0:
+        self._child(conn, fds, request)  # never returns
+    finally:
+      for fd in fds:
+        os.close(fd)
+    log.debug('pid %d: %s', pid, ' '.join(request['argv']))
+
+  def _child(self, conn, fds, request):
+    global _fonts, _hintFile
+    code = 1
+    try:
+      self.sock.close()
+      os.setpgid(0, 0)  # process group which the client forwards signals to
+      signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+      signal.signal(signal.SIGINT, signal.default_int_handler)
+      signal.signal(signal.SIGTERM, signal.SIG_DFL)
+      for i, fd in enumerate(fds):
+        os.dup2(fd, i)
+        os.close(fd)
+      sys.stdin = io.TextIOWrapper(io.FileIO(0, 'r', closefd=False))
+      sys.stdout = io.TextIOWrapper(io.FileIO(1, 'w', closefd=False), line_buffering=True)
+      sys.stderr = io.TextIOWrapper(io.FileIO(2, 'w', closefd=False), line_buffering=True)
+      os.chdir(request['cwd'])
+      os.environ.clear()
+      os.environ.update(request['env'])
+      # let the command configure logging as it would in a new process
+      root = logging.getLogger()
+      for handler in list(root.handlers):
+        root.removeHandler(handler)
+      root.setLevel(logging.WARNING)
+      _fonts = dict(self.fonts)
+      _hintFile = self.hintWrite
+      self.fonts = None
+      conn.sendall((json.dumps({'pid': os.getpid()}) + '\n').encode('utf-8'))
+      try:
+        self.run(request['argv'])
+        code = 0
+      except SystemExit as e:
+        if e.code is None:
+          code = 0
+        elif isinstance(e.code, int):
+          code = e.code
+        else:
+          print(e.code, file=sys.stderr)
+          code = 1
+      except KeyboardInterrupt:
+        code = 130
+      except BaseException:
+        traceback.print_exc()
+        code = 1
+      sys.stdout.flush()
+      sys.stderr.flush()
+      conn.sendall((json.dumps({'exit': code}) + '\n').encode('utf-8'))
+    except BaseException:
+      try:
+        traceback.print_exc()
+      except BaseException:
+        pass
+    finally:
+      os._exit(code)
+
+
+def _isListening(socketPath):
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    sock.connect(socketPath)
+    return True
+  except OSError:
+    return False
+  finally:
+    sock.close()
@@ -0,0 +1,125 @@
+#
+# Tests that FontBuilder.buildStaticFormats makes the same font files as fontmake.
+# Run from the repository root with `make test_unit`, or:
+#
+#   python -m unittest discover -s misc/fontbuildlib -t misc -p test_builder.py
+#
+import shutil
+import tempfile
+import unittest
+from os.path import join as pjoin
+from defcon import Font
+from fontTools.ttLib import TTFont
+from fontmake.__main__ import main as fontmake
+from .builder import FontBuilder
+
+# head fields which record when a font file was made
+_HEAD_VOLATILE = ('modified', 'checkSumAdjustment')
+
+
+def _drawRect(pen, x0, y0, x1, y1):
+  pen.moveTo((x0, y0))
+  pen.lineTo((x0, y1))
+  pen.lineTo((x1, y1))
+  pen.lineTo((x1, y0))
+  pen.closePath()
+
+
+def _makeUFO(path):
+  font = Font()
+  font.info.familyName = 'Test'
+  font.info.styleName = 'Regular'
+  font.info.unitsPerEm = 1000
+  font.info.ascender = 800
+  font.info.descender = -200
+  font.info.xHeight = 500
+  font.info.capHeight = 700
+  font.info.versionMajor = 1
+  font.info.versionMinor = 0
+  font.info.openTypeHeadCreated = '2024/01/01 00:00:00'
+
+  # overlapping contours
+  g = font.newGlyph('A')
+  g.unicodes = [0x41]
+  g.width = 600
+  pen = g.getPen()
+  _drawRect(pen, 50, 0, 350, 700)
+  _drawRect(pen, 250, 0, 550, 700)
+
+  g = font.newGlyph('acutecomb')
+  g.unicodes = [0x301]
+  g.width = 0
+  _drawRect(g.getPen(), -100, 650, 100, 800)
+
+  # components which overlap each other
+  g = font.newGlyph('Aacute')
+  g.unicodes = [0xC1]
+  g.width = 600
+  pen = g.getPen()
+  pen.addComponent('A', (1, 0, 0, 1, 0, 0))
+  pen.addComponent('acutecomb', (1, 0, 0, 1, 300, 0))
+
+  # nested components
+  g = font.newGlyph('uni01FA')
+  g.unicodes = [0x1FA]
+  g.width = 600
+  pen = g.getPen()
+  pen.addComponent('Aacute', (1, 0, 0, 1, 0, 0))
+  pen.addComponent('acutecomb', (1, 0, 0, 1, 300, 200))
+
+  # contours and components
+  g = font.newGlyph('B')
+  g.unicodes = [0x42]
+  g.width = 600
+  pen = g.getPen()
+  _drawRect(pen, 0, 0, 100, 100)
+  pen.addComponent('A', (1, 0, 0, 1, 0, 0))
+
+  font.lib['com.github.googlei18n.ufo2ft.filters'] = [
+    {'name': 'transformations', 'kwargs': {'OffsetX': 40}, 'include': ['A']},
+    {'name': 'transformations', 'kwargs': {'OffsetY': 30}, 'include': ['Aacute'],
+     'pre': False},
+  ]
+  font.save(path)
+
+
+class BuildStaticFormatsTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.ufo = pjoin(self.tmpdir, 'Test.ufo')
+    _makeUFO(self.ufo)
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def assertSameFont(self, expectedFile, actualFile):
+    expected, actual = TTFont(expectedFile), TTFont(actualFile)
+    self.assertEqual(sorted(expected.keys()), sorted(actual.keys()))
+    for tag in expected.keys():
+      if tag == 'GlyphOrder':
+        self.assertEqual(expected.getGlyphOrder(), actual.getGlyphOrder())
+      elif tag == 'head':
+        for name in expected['head'].__dict__:
+          if name not in _HEAD_VOLATILE:
+            self.assertEqual(getattr(expected['head'], name),
+                             getattr(actual['head'], name), 'head.' + name)
+      else:
+        self.assertEqual(expected.getTableData(tag), actual.getTableData(tag), tag)
+
+  def test_same_as_fontmake(self):
+    outputs = [pjoin(self.tmpdir, 'Test.otf'), pjoin(self.tmpdir, 'Test.ttf')]
+    FontBuilder().buildStaticFormats(self.ufo, outputs)
+    for output in outputs:
+      expected = pjoin(self.tmpdir, 'fontmake-' + output[-3:] + '.' + output[-3:])
+      # same as the Makefile used to run (see FM_ARGS_2)
+      fontmake([
+        '-u', self.ufo, '-o', output[-3:], '--output-path', expected,
+        '--verbose', 'WARNING', '--overlaps-backend', 'pathops',
+        '--flatten-components', '--no-autohint', '--production-names',
+      ])
+      self.assertSameFont(expected, output)
+
+
+if __name__ == '__main__':
+  unittest.main()
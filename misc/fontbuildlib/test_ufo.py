@@ -0,0 +1,65 @@
+#
+# Tests of saveUFOIncremental. Run all tests of fontbuildlib with `make test_unit`, or
+# just these from the repository root:
+#
+#   python -m unittest discover -s misc/fontbuildlib -t misc -p test_ufo.py
+#
+import os
+import shutil
+import tempfile
+import unittest
+from os.path import join as pjoin
+from defcon import Font
+from .ufo import saveUFOIncremental
+
+
+def _makeFont():
+  font = Font()
+  font.info.familyName = 'Test'
+  font.info.unitsPerEm = 1000
+  for name, width in (('a', 500), ('b', 600)):
+    glyph = font.newGlyph(name)
+    glyph.width = width
+    pen = glyph.getPen()
+    pen.moveTo((0, 0))
+    pen.lineTo((0, 100))
+    pen.lineTo((100, 100))
+    pen.closePath()
+  return font
+
+
+class SaveUFOIncrementalTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.path = pjoin(self.tmpdir, 'Test.ufo')
+    self.font = _makeFont()
+    self.assertEqual(saveUFOIncremental(self.font, self.path), 2)
+    # pretend the UFO was written a while ago
+    os.utime(self.path, ns=(0, 0))
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def test_unchanged(self):
+    self.assertEqual(saveUFOIncremental(self.font, self.path), 0)
+    self.assertEqual(os.stat(self.path).st_mtime_ns, 0)
+
+  def test_glyph_edit_updates_mtime(self):
+    self.font['a'].width = 510
+    self.assertEqual(saveUFOIncremental(self.font, self.path), 1)
+    self.assertGreater(os.stat(self.path).st_mtime_ns, 0)
+
+  def test_glyph_removal_updates_mtime(self):
+    del self.font['b']
+    self.assertEqual(saveUFOIncremental(self.font, self.path), 0)
+    self.assertGreater(os.stat(self.path).st_mtime_ns, 0)
+
+  def test_info_edit_updates_mtime(self):
+    self.font.info.familyName = 'Test 2'
+    self.assertEqual(saveUFOIncremental(self.font, self.path), 0)
+    self.assertGreater(os.stat(self.path).st_mtime_ns, 0)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,248 @@
+import os
+import json
+import time
+import logging
+import posixpath
+from contextlib import contextmanager
+from os.path import dirname
+from .util import mkdirs
+
+# Per-stage build timing.
+#
+# Stages of a build are timed like this:
+#
+#   with timing.build('Inter-Bold'):
+#     with timing.stage('remove overlaps'):
+#       ...
+#
+# Stages can be nested and are identified by their path, e.g. "compile otf/save".
+# Times of ufo2ft's internal stages (e.g. feature compilation) are picked up from its
+# "ufo2ft.timer" logger and recorded as sub-stages of the current stage. Stages which
+# ufo2ft doesn't time can be timed by passing it classes made with timedClass().
+#
+# Timing is disabled (and build() and stage() do nothing) unless the FONTBUILD_TIMINGS
+# environment variable is set to a filename, e.g. by "fontbuild --timings <file>" or
+# "make TIMINGS=<file>". When a build finishes, a JSON record of its stage times is
+# appended to that file as a single line. As the file is only ever appended to, it can
+# be shared by concurrent processes (worker processes of FontBuilder.buildStatics,
+# parallel make jobs) and the records aggregated afterwards with aggregate(), which is
+# what "fontbuild timings <file>" does.
+
+log = logging.getLogger(__name__)
+
+ENV_VAR = 'FONTBUILD_TIMINGS'
+
+# ufo2ft timer messages => our stage names
+_UFO2FT_STAGES = {
+  'preprocess UFO': 'ufo2ft preprocess',
+  'compile a basic TTF': 'outline compile',
+  'run feature writers': 'feature compile',
+  'build OpenType features': 'feature compile',
+  'postprocess TTF': 'postprocess',
+  'merge fonts to variable': 'merge masters',
+}
+
+_current = None  # _Build being timed in this process
+_handlerInstalled = False
+
+
+class _Build:
+  def __init__(self, name):
+    self.name = name
+    self.stages = {}  # stage path => seconds, in order of start
+    self.path = []    # names of currently running stages
+
+  def add(self, name, seconds):
+    key = '/'.join(self.path + [name])
+    self.stages[key] = self.stages.get(key, 0.0) + seconds
+
+
+class _Ufo2ftTimerHandler(logging.Handler):
+  def emit(self, record):
+    b = _current
+    if b is None or not isinstance(record.args, dict):
+      return
+    name = _UFO2FT_STAGES.get(record.args.get('msg'))
+    if name is not None:
+      b.add(name, float(record.args['time']))
+
+
+def _installUfo2ftHandler():
+  global _handlerInstalled
+  if _handlerInstalled:
+    return
+  _handlerInstalled = True
+  logger = logging.getLogger('ufo2ft.timer')
+  logger.addHandler(_Ufo2ftTimerHandler())
+  if not logger.isEnabledFor(logging.DEBUG):
+    # enable ufo2ft's timers without printing their messages
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+
+
+def enabled():
+  return bool(os.environ.get(ENV_VAR))
+
+
+@contextmanager
+def build(name, command=None):
+  # Times a build named name (e.g. a font file or UFO name.) Builds started while
+  # another build is being timed are timed as part of the outer build.
+  global _current
+  filename = os.environ.get(ENV_VAR)
+  if not filename or _current is not None:
+    yield
+    return
+  b = _Build(name)
+  _installUfo2ftHandler()
+  startTime = time.time()
+  start = time.perf_counter()
+  _current = b
+  try:
+    yield
+  finally:
+    _current = None
+  record = {
+    'build': name,
+    'command': command,
+    'pid': os.getpid(),
+    'time': round(startTime, 3),
+    'total': time.perf_counter() - start,
+    'stages': b.stages,
+  }
+  appendRecord(filename, record)
+  if log.isEnabledFor(logging.INFO):
+    log.info('stage timings of %s:\n%s', name, formatSummary(aggregate([record])))
+
+
+@contextmanager
+def stage(name):
+  b = _current
+  if b is None:
+    yield
+    return
+  b.add(name, 0.0)  # so that stages are ordered by start, parents before children
+  b.path.append(name)
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    b.path.pop()
+  b.add(name, time.perf_counter() - start)
+
+
+def timedClass(cls, methodName, stageName):
+  # Returns a subclass of cls which times calls to its method methodName as stageName.
+  # Used to time stages of ufo2ft which it doesn't time itself.
+  def timed(self, *args, **kwargs):
+    with stage(stageName):
+      return getattr(super(subclass, self), methodName)(*args, **kwargs)
+  subclass = type(cls.__name__, (cls,), {methodName: timed})
+  return subclass
+
+
+def appendRecord(filename, record):
+  mkdirs(dirname(filename) or '.')
+  line = json.dumps(record, separators=(',', ':')) + '\n'
+  # a single write in append mode, so that lines of concurrent processes don't mix
+  with open(filename, 'a', encoding='utf-8') as f:
+    f.write(line)
+
+
+def readRecords(filename):
+  records = []
+  with open(filename, 'r', encoding='utf-8') as f:
+    for lineno, line in enumerate(f, 1):
+      line = line.strip()
+      if not line:
+        continue
+      try:
+        records.append(json.loads(line))
+      except ValueError:
+        log.warning('%s:%d: ignoring malformed record', filename, lineno)
+  return records
+
+
+def aggregate(records):
+  # Returns a summary of records: {
+  #   "builds": number of builds,
+  #   "total":  sum of build times,
+  #   "stages": [{"stage", "count", "total", "self", "max"}, ...] in pipeline order,
+  # }
+  # "self" is the time of a stage excluding its recorded sub-stages.
+  stages = {}  # path => {...}
+  order = []   # stage paths in order of first appearance, parents before children
+  for record in records:
+    for path, seconds in record['stages'].items():
+      s = stages.get(path)
+      if s is None:
+        s = stages[path] = {'stage': path, 'count': 0, 'total': 0.0, 'max': 0.0}
+        _insertStage(order, path)
+      s['count'] += 1
+      s['total'] += seconds
+      s['max'] = max(s['max'], seconds)
+  for path in order:
+    s = stages[path]
+    children = [stages[p]['total'] for p in stages if posixpath.dirname(p) == path]
+    s['self'] = max(0.0, s['total'] - sum(children))
+  return {
+    'builds': len(records),
+    'total': sum(record['total'] for record in records),
+    'stages': [stages[path] for path in order],
+  }
+
+
+def _insertStage(order, path):
+  # inserts path after its parent's last descendant, or last if it has no parent
+  parent = posixpath.dirname(path)
+  if parent:
+    for i in range(len(order) - 1, -1, -1):
+      if order[i] == parent or order[i].startswith(parent + '/'):
+        order.insert(i + 1, path)
+        return
+  order.append(path)
+
+
+def formatSummary(summary, baseline=None):
+  # Formats a summary returned by aggregate() as a table.
+  # If baseline (another summary) is given, the change in time of each stage is shown.
+  total = summary['total']
+  baselineStages = {}
+  if baseline is not None:
+    baselineStages = {s['stage']: s for s in baseline['stages']}
+  header = ['stage', 'count', 'total', 'self', 'max', '%']
+  if baseline is not None:
+    header.append('change')
+  rows = []
+  for s in summary['stages']:
+    depth = s['stage'].count('/')
+    row = [
+      '  ' * depth + s['stage'].rsplit('/', 1)[-1],
+      str(s['count']),
+      '%.2fs' % s['total'],
+      '%.2fs' % s['self'],
+      '%.2fs' % s['max'],
+      '%.1f' % (100.0 * s['total'] / total if total else 0.0),
+    ]
+    if baseline is not None:
+      row.append(_formatChange(s['total'], baselineStages.get(s['stage'])))
+    rows.append(row)
+  row = ['total (%d builds)' % summary['builds'], '', '%.2fs' % total, '', '', '']
+  if baseline is not None:
+    row.append(_formatChange(total, baseline))
+  rows.append(row)
+  widths = [max(len(r[i]) for r in [header] + rows) for i in range(len(header))]
+  lines = []
+  for r in [header] + rows:
+    cols = [r[0].ljust(widths[0])] + [c.rjust(w) for c, w in zip(r[1:], widths[1:])]
+    lines.append('  '.join(cols).rstrip())
+  return '\n'.join(lines)
+
+
+def _formatChange(seconds, baseline):
+  if baseline is None:
+    return 'new'
+  prev = baseline['total']
+  if prev == 0:
+    return ''
+  return '%+.1f%%' % (100.0 * (seconds - prev) / prev)
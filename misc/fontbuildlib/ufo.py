@@ -0,0 +1,148 @@
+import os
+import shutil
+import hashlib
+import plistlib
+from os.path import isdir, join as pjoin
+from fontTools.ufoLib import UFOWriter
+from fontTools.ufoLib.glifLib import writeGlyphToString
+
+# Incremental UFO writing.
+#
+# Saving a UFO with defcon or ufoLib2 to a new location (or with overwrite=True) writes
+# every .glif file, even when only a handful of glyphs changed. saveUFOIncremental
+# instead updates an existing UFO in place and only writes the .glif files of glyphs
+# that actually changed.
+#
+# Change detection uses a per-glyph digest of the glyph's GLIF data, stored in the UFO's
+# data directory together with the size and mtime of the .glif file at the time it was
+# written. A glyph is rewritten when its digest differs, or when its file has been
+# modified by something else since it was written.
+#
+# Writing a few files inside a UFO does not change the mtime of the .ufo directory itself,
+# which is what make looks at, so the directory's mtime is updated whenever anything in
+# the UFO was written.
+
+GLYPH_DIGESTS_FILENAME = 'com.rsms.inter.glyphdigests.plist'
+
+
+def glyphDigest(glyph, glyphName=None):
+  data = writeGlyphToString(
+    glyphName or glyph.name, glyph, glyph.drawPoints, validate=False)
+  return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def _readDigests(path):
+  try:
+    with open(pjoin(path, 'data', GLYPH_DIGESTS_FILENAME), 'rb') as f:
+      return plistlib.load(f)  # { layerName: { glyphName: [digest, mtime_ns, size] } }
+  except (OSError, plistlib.InvalidFileException):
+    return {}
+
+
+def _fileIsUnchanged(filename, entry):
+  try:
+    st = os.stat(filename)
+  except OSError:
+    return False
+  return st.st_mtime_ns == entry[1] and st.st_size == entry[2]
+
+
+def _statFiles(path):
+  # Returns {relpath: (mtime_ns, size)} of the non-glyph files of the UFO at path.
+  # These are rewritten by UFOWriter only when their contents changed. Writing or
+  # deleting any glyph also changes the glyph digests file.
+  files = {}
+  try:
+    entries = list(os.scandir(path))
+  except OSError:
+    return files
+  for entry in entries:
+    if entry.is_dir():
+      names = [pjoin(entry.name, fn) for fn in ('contents.plist', 'layerinfo.plist')]
+      if entry.name == 'data':
+        names.append(pjoin(entry.name, GLYPH_DIGESTS_FILENAME))
+    else:
+      names = [entry.name]
+    for name in names:
+      try:
+        st = os.stat(pjoin(path, name))
+      except OSError:
+        continue
+      files[name] = (st.st_mtime_ns, st.st_size)
+  return files
+
+
+def _openWriter(font, path):
+  # Returns a UFOWriter for path. If an existing UFO at path has a different default
+  # layer than font, it is removed first as it can't be updated in place.
+  if isdir(path):
+    writer = UFOWriter(path, validate=False)
+    defaultLayerName = font.layers.defaultLayer.name
+    for name, dirname in writer.layerContents.items():
+      if dirname == 'glyphs' and name != defaultLayerName:
+        writer.close()
+        shutil.rmtree(path)
+        break
+    else:
+      return writer
+  return UFOWriter(path, validate=False)
+
+
+def saveUFOIncremental(font, path):
+  # Saves font (a defcon or ufoLib2 Font) to the UFO at path, creating it if needed.
+  # Returns the number of glyphs which were written.
+  oldFiles = _statFiles(path)
+  writer = _openWriter(font, path)
+  oldDigests = _readDigests(path)
+  newDigests = {}
+  nwritten = 0
+
+  defaultLayer = font.layers.defaultLayer
+  layerNames = []
+  for layer in font.layers:
+    layerNames.append(layer.name)
+    glyphSet = writer.getGlyphSet(
+      layer.name,
+      defaultLayer=(layer is defaultLayer),
+      validateRead=False,
+      validateWrite=False,
+    )
+    glyphsDir = pjoin(path, writer.layerContents[layer.name])
+    oldLayerDigests = oldDigests.get(layer.name, {})
+    layerDigests = {}
+    for glyph in layer:
+      name = glyph.name
+      digest = glyphDigest(glyph, name)
+      entry = oldLayerDigests.get(name)
+      filename = glyphSet.contents.get(name)
+      if (entry is not None and filename is not None and entry[0] == digest and
+          _fileIsUnchanged(pjoin(glyphsDir, filename), entry)):
+        layerDigests[name] = entry
+        continue
+      glyphSet.writeGlyph(name, glyph, glyph.drawPoints, validate=False)
+      st = os.stat(pjoin(glyphsDir, glyphSet.contents[name]))
+      layerDigests[name] = [digest, st.st_mtime_ns, st.st_size]
+      nwritten += 1
+    # remove glyphs which are no longer in the font
+    for name in set(glyphSet.contents) - set(layerDigests):
+      glyphSet.deleteGlyph(name)
+    glyphSet.writeContents()
+    glyphSet.writeLayerInfo(layer)
+    newDigests[layer.name] = layerDigests
+
+  # remove layers which are no longer in the font
+  for name in set(writer.layerContents) - set(layerNames):
+    writer.deleteGlyphSet(name)
+  writer.writeLayerContents(layerNames)
+
+  # Note: these are only written if their contents changed
+  writer.writeInfo(font.info)
+  writer.writeGroups(dict(font.groups))
+  writer.writeKerning(dict(font.kerning))
+  writer.writeLib(dict(font.lib))
+  writer.writeFeatures(font.features.text or '')
+  writer.writeData(GLYPH_DIGESTS_FILENAME, plistlib.dumps(newDigests))
+  writer.close()
+  if _statFiles(path) != oldFiles:
+    os.utime(path)
+  return nwritten
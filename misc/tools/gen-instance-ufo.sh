@@ -74,6 +74,16 @@ if [ -z "$INSTANCE" ]; then
   exit
 fi
 
+# Instance UFOs are usually generated all at once by "fontbuild instancegen" (see the
+# "%.instances" target in the Makefile), in which case we just update mtime.
+# Note: instancegen only writes the glyphs which changed, so an instance UFO is not
+# necessarily newer than the designspace; check the ".instances" stamp file instead.
+INSTANCES=${DESIGNSPACE%.designspace}.instances
+if [ -d "$UFO" ] && [ "$INSTANCES" -nt "$DESIGNSPACE" ]; then
+  echo "touch $UFO"
+  touch "$UFO"
+  exit
+fi
+
 set -x
-fontmake -o ufo -m "$DESIGNSPACE" --output-path "$UFO" -i "$INSTANCE"
-exec python misc/tools/postprocess_instance_ufo.py "$UFO"
+exec python misc/fontbuild instancegen "$DESIGNSPACE" "$INSTANCE" -o "$UFO"
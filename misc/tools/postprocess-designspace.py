@@ -8,6 +8,9 @@ from datetime import datetime
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), 'tools')))
 from common import getGitHash, getVersion
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from fontbuildlib.glif import GlifReader
+
 
 OPT_EDITABLE = False  # --editable
 
@@ -190,15 +193,13 @@ def copy_anchors_from_components(font, g):
     g.appendAnchor(a)
 
 
-def find_glyphs_to_decompose(designspace_source):
+def find_glyphs_to_decompose(ufo_file):
+  # Components are read straight from the .glif files; the UFO is loaded and saved
+  # only once, by update_source_ufo
   glyph_names = set()
-  # print("find_glyphs_to_decompose inspecting %r" % designspace_source.name)
-  font = defcon.Font(designspace_source.path)
-  for g in font:
-    # copy_anchors_from_components(font, g)
+  for g in GlifReader(ufo_file):
     if should_decompose_glyph(g):
       glyph_names.add(g.name)
-  font.save(designspace_source.path)
   return list(glyph_names)
 
 
@@ -247,12 +248,13 @@ def update_sources(designspace):
   with Pool() as p:
     sources = [source for source in designspace.sources]
     # sources = [s for s in sources if s.name == "Inter Thin"] # DEBUG
+    source_files = list(set([s.path for s in sources]))
+    # decompose the same glyphs in all masters, to keep them compatible
     glyphs_to_decompose = set()
-    for glyph_names in p.map(find_glyphs_to_decompose, sources):
+    for glyph_names in p.map(find_glyphs_to_decompose, source_files):
       glyphs_to_decompose.update(glyph_names)
     glyphs_to_decompose = list(glyphs_to_decompose)
     # print("glyphs marked to be decomposed: %s" % ', '.join(glyphs_to_decompose))
-    source_files = list(set([s.path for s in sources]))
     p.starmap(update_source_ufo, [(path, glyphs_to_decompose) for path in source_files])
   return designspace
 
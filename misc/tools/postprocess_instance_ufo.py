@@ -22,11 +22,7 @@ def fix_fractional_advance_width(ufo):
       g.width = w
 
 
-def main(argv):
-  ufo_file = argv[1]
-  ufo = defcon.Font(ufo_file)
-  fix_fractional_advance_width(ufo)
-
+def fix_instance_info(ufo):
   # fix legacy names to make style linking work in MS Windows
   familyName = ufo.info.familyName  # e.g. "Inter Display"
   styleName = ufo.info.styleName    # e.g. "ExtraBold"
@@ -43,6 +39,12 @@ def main(argv):
   # round OS/2 weight class values to even 100ths
   ufo.info.openTypeOS2WeightClass = round(ufo.info.openTypeOS2WeightClass / 100) * 100
 
+
+def main(argv):
+  ufo_file = argv[1]
+  ufo = defcon.Font(ufo_file)
+  fix_fractional_advance_width(ufo)
+  fix_instance_info(ufo)
   ufo.save(ufo_file)
 
 
@@ -1,75 +1,75 @@
 #!/usr/bin/env python
 # encoding: utf8
 #
-# This program is run by the Makefile target "docs_fonts" and generates
+# This program is run by the Makefile target "web_subset" and generates
 # subset font files and CSS for the web fonts.
 #
+# With -plan <corpus>, subsets are planned for each font from how often codepoints are
+# used in the corpus instead of using the subsets defined in main. See subset_plan.py
+#
+# With -dedupe, codepoints are moved to other subsets which already have their glyphs
+# (through OpenType features) when that lowers the expected number of bytes downloaded.
+# -report prints the glyphs which are in several subsets and the sizes of each subset.
+#
+# Fonts are subset in-process with fontTools.subset, by a pool of worker processes.
+# Each input font is loaded and fully parsed once, in this process, before the pool is
+# started. A worker process is forked for each subset (maxtasksperchild=1) and so starts
+# out with its own, already parsed copy of the font, which it's free to modify.
+# When processes are not forked (e.g. with the "spawn" start method), workers load the
+# font themselves.
+#
+# Subset files are only generated when they aren't up to date: a manifest in each output
+# directory (MANIFEST_FILENAME) records digests of the input font, the codepoints and the
+# subset options which each subset file was generated from, and of the file itself.
+# Fonts which have no subset files to generate aren't loaded.
+#
+# All fonts are subset in parallel. The subsets of each font are checked to map exactly
+# the codepoints of the font when done; the program exits with an error otherwise, or
+# when any subset fails.
+#
 from __future__ import print_function
-import os, sys, subprocess, os.path
+import os, sys, os.path, io, json, hashlib, argparse
 from os.path import dirname, basename, abspath, join as pjoin
 from multiprocessing import Pool as ProcPool
-from fontTools import ttLib
+import fontTools
+from fontTools import ttLib, subset
 from itertools import groupby
 from operator import itemgetter
 sys.path.append(dirname(abspath(__file__)))
-from common import BASEDIR, VENVDIR
+from common import BASEDIR
+import subset_plan
 
 
 # FORCE can be set to True to subset all fonts regardless if the input source
 # font has changed or not
 FORCE = False
 
+# Bump this when changes to this program change the subset files it generates, so that
+# existing subset files are not considered up to date
+MANIFEST_VERSION = 1
+
+# file in each output directory recording how the subset files in it were generated
+MANIFEST_FILENAME = 'subset-manifest.json'
+
 
 # fonts to subset
 FONTS = [
 
-  # Text family
-  { 'infile':  'build/fonts/var/Inter.var.ttf',
-    'outfile': 'build/fonts/subset/Inter.{subset}.var.woff2',
-    'css_family': 'Inter var experimental',
-    'css_weight': '100 900',
-    'css_style':  'oblique 0deg 10deg',
-  },
-
-  { 'infile':  'build/fonts/var/Inter-roman.var.ttf',
-    'outfile': 'build/fonts/subset/Inter-roman.{subset}.var.woff2',
+  { 'infile':  'build/fonts/var/InterVariable.ttf',
+    'outfile': 'build/fonts/subset/InterVariable.{subset}.woff2',
     'css_family': 'Inter var',
     'css_weight': '100 900',
     'css_style':  'normal',
     'css_extra':  "font-named-instance: 'Regular';",
   },
 
-  { 'infile':  'build/fonts/var/Inter-italic.var.ttf',
-    'outfile': 'build/fonts/subset/Inter-italic.{subset}.var.woff2',
+  { 'infile':  'build/fonts/var/InterVariable-Italic.ttf',
+    'outfile': 'build/fonts/subset/InterVariable-Italic.{subset}.woff2',
     'css_family': 'Inter var',
     'css_weight': '100 900',
     'css_style':  'italic',
     'css_extra':  "font-named-instance: 'Italic';",
   },
-
-  # Display family
-  { 'infile':  'build/fonts/var/InterDisplay.var.ttf',
-    'outfile': 'build/fonts/subset/InterDisplay.{subset}.var.woff2',
-    'css_family': 'InterDisplay var experimental',
-    'css_weight': '100 900',
-    'css_style':  'oblique 0deg 10deg',
-  },
-
-  { 'infile':  'build/fonts/var/InterDisplay-roman.var.ttf',
-    'outfile': 'build/fonts/subset/InterDisplay-roman.{subset}.var.woff2',
-    'css_family': 'InterDisplay var',
-    'css_weight': '100 900',
-    'css_style':  'normal',
-    'css_extra':  "font-named-instance: 'Regular';",
-  },
-
-  { 'infile':  'build/fonts/var/InterDisplay-italic.var.ttf',
-    'outfile': 'build/fonts/subset/InterDisplay-italic.{subset}.var.woff2',
-    'css_family': 'InterDisplay var',
-    'css_weight': '100 900',
-    'css_style':  'italic',
-    'css_extra':  "font-named-instance: 'Italic';",
-  },
 ]
 
 # template for CSS
@@ -114,10 +114,43 @@ SYMBOL_UNICODES = [
 ]
 
 
-SELF_SCRIPT_MTIME = 0
+# manifests of output directories, keyed by directory (see load_manifest)
+MANIFESTS = {}
+
+# codepoints of fonts, keyed by filename (see font_unicodes)
+FONT_UNICODES = {}
+
+# fonts loaded by load_font, keyed by filename. Inherited by forked worker processes.
+LOADED_FONTS = {}
+
+# subset_plan.SizeModel of fonts, or jobs calibrating them, keyed by filename
+SIZE_MODELS = {}
 
 
 def main(argv):
+  argparser = argparse.ArgumentParser(description='Generate subset web fonts and CSS')
+
+  argparser.add_argument('-plan', dest='corpora', metavar='<corpus>', action='append',
+                         help='Plan subsets from the codepoint frequencies of <corpus>, '+
+                              'a text file or JSON list of words (most common first). '+
+                              'Can be given more than once.')
+
+  argparser.add_argument('-page-chars', dest='pageChars', metavar='<n>', type=int,
+                         default=subset_plan.PAGE_CHARS,
+                         help='Number of characters of a page view, when planning. '+
+                              'Defaults to %d' % subset_plan.PAGE_CHARS)
+
+  argparser.add_argument('-dedupe', dest='dedupe', action='store_const',
+                         const=True, default=False,
+                         help='Move codepoints to other subsets which already have their '+
+                              'glyphs, when that lowers the expected download size')
+
+  argparser.add_argument('-report', dest='report', action='store_const',
+                         const=True, default=False,
+                         help='Print glyphs which are in several subsets and subset sizes')
+
+  args = argparser.parse_args(argv[1:])
+
   # defines subsets.
   # Ranges are inclusive.
   # Order should be from most frequently used to least frequently used.
@@ -198,23 +231,63 @@ def main(argv):
 
   )
 
-  global SELF_SCRIPT_MTIME
-  SELF_SCRIPT_MTIME = os.path.getmtime(__file__)
-
-  # XXX DEBUG
-  global FONTS
-  FONTS = FONTS[1:2]
-
-  # generate subset fonts
-  with ProcPool() as procpool:
-    for fontinfo in FONTS:
-      subset_font(fontinfo, subsets, procpool)
+  frequencies = None
+  if args.corpora:
+    subset_plan.PAGE_CHARS = args.pageChars
+    frequencies = subset_plan.load_corpora(args.corpora)
+  planning = frequencies is not None or args.dedupe or args.report
+
+  # subset files of each font, unless subsets are planned, which needs worker processes
+  fontjobs = [None] * len(FONTS)
+  if not planning:
+    fontjobs = [subset_jobs(fontinfo, subsets) for fontinfo in FONTS]
+
+  # load fonts before starting worker processes, so that they inherit them
+  for fontinfo, fjobs in zip(FONTS, fontjobs):
+    if fjobs is None or not all(job['upToDate'] for job in fjobs[1]):
+      load_font(pjoin(BASEDIR, fontinfo['infile']))
+
+  # generate subset fonts. Each worker process subsets one font, as it modifies it.
+  fontsubsets = []
+  jobs = []
+  with ProcPool(maxtasksperchild=1) as procpool:
+    if planning:
+      for fontinfo in FONTS:
+        start_size_model(pjoin(BASEDIR, fontinfo['infile']), procpool)
+    for fontinfo, fjobs in zip(FONTS, fontjobs):
+      if fjobs is None:
+        fsubsets = subsets
+        if frequencies is not None:
+          fsubsets = plan_font(fontinfo, fsubsets, frequencies, procpool)
+        if args.dedupe:
+          fsubsets = dedupe_font(fontinfo, fsubsets, frequencies or {}, procpool)
+        fjobs = subset_jobs(fontinfo, fsubsets)
+      fsubsets, fjobs = fjobs
+      fontsubsets.append(fsubsets)
+      for job in fjobs:
+        if job['upToDate']:
+          print('up-to-date %s -> %s' % (relpath(job['infile']), relpath(job['outfile'])))
+        else:
+          job['result'] = subset_range_async(
+            procpool, job['infile'], job['outfile'], job['unicodeRange'])
+          jobs.append(job)
+    # wait for all subsets, raising the error of any which failed, and record the ones
+    # which were generated in manifests
+    try:
+      for job in jobs:
+        job['result'].get()
+        record_subset(job)
+    finally:
+      save_manifests()
     procpool.close()
     procpool.join()
 
+  for fontinfo, fsubsets in zip(FONTS, fontsubsets):
+    check_subsets(fontinfo, fsubsets)
+
   # generate CSS
-  for fontinfo in FONTS:
-    css = genCSS(fontinfo, subsets)
+  for fontinfo, fsubsets in zip(FONTS, fontsubsets):
+    css = genCSS(fontinfo, fsubsets)
     infile, _ = os.path.splitext(basename(fontinfo['infile']))
     cssfile = pjoin(BASEDIR, 'docs/_includes', infile + '.css')
     # print('css:\n' + css) # DEBUG
@@ -222,83 +295,324 @@ def main(argv):
     with open(cssfile, 'w') as f:
       f.write(css)
 
+  if args.report:
+    for fontinfo, fsubsets in zip(FONTS, fontsubsets):
+      report_font(fontinfo, fsubsets)
+
 
-def subset_font(fontinfo, subsets, procpool):
+def subset_jobs(fontinfo, subsets) -> ([dict], [dict]):
+  # Returns the subsets of the font of fontinfo, including "extra", and the subset files
+  # to generate for them: { infile outfile unicodeRange entry upToDate }
   infile          = pjoin(BASEDIR, fontinfo['infile'])
   outfileTemplate = pjoin(BASEDIR, fontinfo['outfile'])
-  font            = ttLib.TTFont(infile)
-  ucall           = set(getUnicodeMap(font)) # set of all codepoints mapped by the font
+  ucall           = font_unicodes(infile) # set of all codepoints mapped by the font
   covered         = set()  # set of codepoints covered by 'subsets'
+  inputDigest     = file_digest(infile)
+  jobs            = []
+
+  os.makedirs(dirname(outfileTemplate), exist_ok=True)
+
+  def subset_job(outfile, unicodeRange):
+    entry = manifest_entry(inputDigest, outfile, unicodeRange)
+    jobs.append({
+      'infile': infile,
+      'outfile': outfile,
+      'unicodeRange': unicodeRange,
+      'entry': entry,
+      'upToDate': not FORCE and is_up_to_date(outfile, entry),
+    })
 
   for subset in subsets:
     unicodes, unicodeRange = genUnicodeRange(subset['codepoints'])
     unicodes = unicodes - covered
     covered = covered.union(unicodes)
     outfile = outfileTemplate.format(subset=subset['name'])
-    subset_range_async(procpool, infile, outfile, unicodeRange)
+    subset_job(outfile, unicodeRange)
 
   # generate "extra" subset of remaining codepoints
   extraUnicodes = ucall - covered
+  if len(extraUnicodes) == 0:
+    return list(subsets), jobs
   _, extraUnicodeRange = genUnicodeRange(extraUnicodes)
   outfile = outfileTemplate.format(subset='extra')
-  subset_range_async(procpool, infile, outfile, unicodeRange)
+  subset_job(outfile, extraUnicodeRange)
+  return list(subsets) + [{ 'name':'extra' }], jobs
+
+
+def manifest_entry(inputDigest :str, outfile :str, unicodeRange :str) -> dict:
+  # Returns the manifest entry of a subset file: digests of what it's generated from
+  options = subset_options(outfile)
+  codepoints = sorted(set(subset.parse_unicodes(unicodeRange)))
+  return {
+    'input': inputDigest,
+    'codepoints': hashlib.sha256(
+      ','.join('%04X' % cp for cp in codepoints).encode('utf-8')).hexdigest(),
+    'options': hashlib.sha256(json.dumps(
+      [MANIFEST_VERSION, fontTools.version, sorted(vars(options).items())]
+    ).encode('utf-8')).hexdigest(),
+  }
+
+
+def is_up_to_date(outfile :str, entry :dict) -> bool:
+  # True if outfile was generated from what entry describes and hasn't changed since
+  recorded = load_manifest(dirname(outfile)).get(basename(outfile))
+  if recorded is None or not os.path.exists(outfile):
+    return False
+  return recorded == dict(entry, output=file_digest(outfile))
+
+
+def record_subset(job :dict):
+  # Records a generated subset file in the manifest of its directory
+  outfile = job['outfile']
+  manifest = load_manifest(dirname(outfile))
+  manifest[basename(outfile)] = dict(job['entry'], output=file_digest(outfile))
+
+
+def load_manifest(dir :str) -> {str:dict}:
+  # Returns the manifest of subset files in dir, keyed by filename
+  manifest = MANIFESTS.get(dir)
+  if manifest is None:
+    manifest = {}
+    try:
+      with open(pjoin(dir, MANIFEST_FILENAME), 'r') as f:
+        manifest = json.load(f)['subsets']
+    except (OSError, ValueError, KeyError):
+      pass
+    MANIFESTS[dir] = manifest
+  return manifest
+
+
+def save_manifests():
+  for dir, manifest in MANIFESTS.items():
+    filename = pjoin(dir, MANIFEST_FILENAME)
+    with open(filename + '.tmp', 'w') as f:
+      json.dump({ 'subsets': manifest }, f, indent=2, sort_keys=True)
+      f.write('\n')
+    os.replace(filename + '.tmp', filename)
+
+
+def file_digest(filename :str) -> str:
+  h = hashlib.sha256()
+  with open(filename, 'rb') as f:
+    while True:
+      buf = f.read(1024 * 1024)
+      if not buf:
+        break
+      h.update(buf)
+  return h.hexdigest()
+
+
+def font_unicodes(infile :str) -> {int}:
+  # Returns the codepoints of the font at infile, without loading all of it
+  unicodes = FONT_UNICODES.get(infile)
+  if unicodes is None:
+    font = LOADED_FONTS.get(infile)
+    if font is None:
+      font = ttLib.TTFont(infile, lazy=True)
+    unicodes = FONT_UNICODES[infile] = set(getUnicodeMap(font))
+  return unicodes
+
+
+def check_subsets(fontinfo, subsets):
+  # Exits with an error unless the subset files of the font of fontinfo together map
+  # exactly the codepoints of the font
+  infile = pjoin(BASEDIR, fontinfo['infile'])
+  outfileTemplate = pjoin(BASEDIR, fontinfo['outfile'])
+  ucall = font_unicodes(infile)
+  covered = set()
+  for subset in subsets:
+    outfile = outfileTemplate.format(subset=subset['name'])
+    covered.update(getUnicodeMap(ttLib.TTFont(outfile)))
+  errors = []
+  if len(ucall - covered) > 0:
+    errors.append('codepoints of the font missing from all subsets: ' +
+                  genCodepointList(ucall - covered))
+  if len(covered - ucall) > 0:
+    errors.append('codepoints in subsets not in the font: ' +
+                  genCodepointList(covered - ucall))
+  if errors:
+    for error in errors:
+      print('%s: %s' % (relpath(infile), error), file=sys.stderr)
+    sys.exit(1)
+
+
+def plan_font(fontinfo, subsets, frequencies, procpool) -> [dict]:
+  # Returns subsets of the font of fontinfo planned from codepoint frequencies.
+  # Prints the plan, and how it compares to subsets.
+  infile = pjoin(BASEDIR, fontinfo['infile'])
+  model = size_model(infile, procpool)
+  ucall = sorted(getUnicodeMap(model.font))
+  planned = subset_plan.plan_subsets(model, frequencies, ucall)
+
+  print('plan for %s:' % relpath(infile))
+  stats = subset_plan.evaluate(model, frequencies, subset_parts(planned, ucall))
+  for s in stats:
+    print('  %-10s %5d codepoints %5d glyphs  p=%.3f  ~%.1f kB' % (
+      s['name'], s['codepoints'], s['glyphs'], s['probability'], s['bytes'] / 1024))
+  defaultStats = subset_plan.evaluate(model, frequencies, subset_parts(subsets, ucall))
+  print('  ~%.1f kB per page view (%.1f kB with the default subsets)' % (
+    subset_plan.expected_bytes(stats) / 1024,
+    subset_plan.expected_bytes(defaultStats) / 1024))
+
+  return planned
+
+
+def dedupe_font(fontinfo, subsets, frequencies, procpool) -> [dict]:
+  # Returns subsets of the font of fontinfo with codepoints moved to other subsets which
+  # already have their glyphs (see subset_plan.dedupe_subsets)
+  infile = pjoin(BASEDIR, fontinfo['infile'])
+  model = size_model(infile, procpool)
+  ucall = sorted(getUnicodeMap(model.font))
+  parts = list(subset_parts(subsets, ucall))
+  deduped = subset_plan.dedupe_subsets(model, frequencies, parts)
+  dedupedParts = list(subset_parts(deduped, ucall))
+
+  before = dict(parts)
+  moved = 0
+  for name, codepoints in dedupedParts:
+    moved += len(set(codepoints) - set(before.get(name, [])))
+  print('dedupe %s: moved %d codepoints, ~%.1f kB -> ~%.1f kB per page view' % (
+    relpath(infile), moved,
+    subset_plan.expected_bytes(subset_plan.evaluate(model, frequencies, parts)) / 1024,
+    subset_plan.expected_bytes(subset_plan.evaluate(model, frequencies, dedupedParts)) / 1024))
+
+  return deduped
+
+
+def report_font(fontinfo, subsets):
+  # Prints the sizes of subset files of the font of fontinfo, and glyphs which are in
+  # several of them
+  infile = pjoin(BASEDIR, fontinfo['infile'])
+  outfileTemplate = pjoin(BASEDIR, fontinfo['outfile'])
+  model = size_model(infile, None)
+  ucall = sorted(getUnicodeMap(model.font))
+  stats = subset_plan.duplication(model, list(subset_parts(subsets, ucall)))
+
+  print('subsets of %s:' % relpath(infile))
+  totalSize = 0
+  totalShared = 0
+  for s in stats:
+    outfile = outfileTemplate.format(subset=s['name'])
+    size = os.path.getsize(outfile)
+    totalSize += size
+    totalShared += s['sharedBytes']
+    print('  %-10s %7.1f kB %5d glyphs, %d also in other subsets (~%.1f kB%s)' % (
+      s['name'], size / 1024, s['glyphs'], s['shared'], s['sharedBytes'] / 1024,
+      ': ' + ', '.join(s['sharedWith']) if s['sharedWith'] else ''))
+    tables = table_sizes(outfile)
+    other = sum(tables.values())
+    breakdown = []
+    for tag in ('glyf', 'gvar', 'CFF ', 'CFF2', 'GPOS', 'GSUB'):
+      if tag in tables:
+        breakdown.append('%s %.1f kB' % (tag.strip(), tables[tag] / 1024))
+        other -= tables[tag]
+    breakdown.append('other %.1f kB' % (other / 1024))
+    print('  %-10s tables: %s (uncompressed)' % ('', ', '.join(breakdown)))
+  print('  total %.1f kB, of which ~%.1f kB are glyphs also in other subsets' % (
+    totalSize / 1024, totalShared / 1024))
+
+
+def start_size_model(infile :str, procpool):
+  # Starts making the subsets of the font at infile which its size model is calibrated
+  # with (see size_model), so that fonts can be calibrated in parallel
+  if infile not in SIZE_MODELS:
+    ucall = sorted(getUnicodeMap(load_font(infile)))
+    SIZE_MODELS[infile] = (
+      procpool.apply_async(subset_size, (infile, [])),
+      procpool.apply_async(subset_size, (infile, ucall)),
+    )
+
+
+def size_model(infile :str, procpool) -> subset_plan.SizeModel:
+  # Returns a subset_plan.SizeModel of the font at infile, calibrated with actual subsets
+  # of the font made in procpool
+  start_size_model(infile, procpool)
+  model = SIZE_MODELS[infile]
+  if isinstance(model, tuple):
+    emptySize, fullSize = model
+    model = subset_plan.SizeModel(load_font(infile), subset_options(infile))
+    model.calibrate(emptySize.get(), fullSize.get())
+    SIZE_MODELS[infile] = model
+  return model
+
+
+def subset_parts(subsets, ucall :[int]):
+  # Yields (name, codepoints) of subsets, with the codepoints of the font (ucall) which
+  # each subset, and not any subset before it, has, and "extra" for the rest
+  ucset = set(ucall)
+  covered = set()
+  for subset in subsets:
+    if 'codepoints' not in subset:
+      continue  # "extra"
+    unicodes, _ = genUnicodeRange(subset['codepoints'])
+    unicodes = (unicodes & ucset) - covered
+    covered.update(unicodes)
+    yield subset['name'], sorted(unicodes)
+  if len(covered) < len(ucset):
+    yield 'extra', sorted(ucset - covered)
+
+
+def table_sizes(fontfile :str) -> {str:int}:
+  # uncompressed size of each table of the font file
+  font = ttLib.TTFont(fontfile)
+  return { tag: entry.origLength if hasattr(entry, 'origLength') else entry.length
+           for tag, entry in font.reader.tables.items() }
 
 
 def subset_range_async(procpool :ProcPool, infile :str, outfile :str, unicodeRange :str):
-  if not FORCE:
-    try:
-      outmtime = os.path.getmtime(outfile)
-      if outmtime > os.path.getmtime(infile) and outmtime > SELF_SCRIPT_MTIME:
-        print('up-to-date %s -> %s' % (relpath(infile), relpath(outfile)))
-        return
-    except:
-      pass
-  procpool.apply_async( subset_range,(infile, outfile, unicodeRange),
-                        error_callback=lambda err: onProcErr(procpool, err) )
+  return procpool.apply_async(subset_range, (infile, outfile, unicodeRange))
+
+
+def subset_options(outfile :str) -> subset.Options:
+  # same as the pyftsubset options
+  #   --layout-features=* --recommended-glyphs --no-recalc-bounds
+  #   --no-prune-unicode-ranges --no-hinting [--flavor=woff2]
+  options = subset.Options()
+  options.layout_features = ['*']
+  options.recommended_glyphs = True
+  options.recalc_bounds = False
+  options.prune_unicode_ranges = False
+  options.hinting = False
+  if outfile.endswith('.woff2'):
+    options.flavor = 'woff2'
+  return options
 
 
-def onProcErr(procpool, err):
-  procpool.terminate()
-  raise err
-  sys.exit(1)
+def load_font(infile :str) -> ttLib.TTFont:
+  # Returns the fully parsed font at infile, loading it if needed.
+  # The font must not be modified, except by subset_range in a worker process.
+  font = LOADED_FONTS.get(infile)
+  if font is None:
+    font = subset.load_font(infile, subset_options(infile), lazy=False)
+    font.ensureDecompiled()
+    LOADED_FONTS[infile] = font
+  return font
+
+
+def subset_size(infile :str, unicodes :[int]) -> int:
+  # Runs in a worker process. Returns the size of a subset of infile, in bytes.
+  options = subset_options(infile + '.woff2')
+  font = load_font(infile)
+  subsetter = subset.Subsetter(options)
+  subsetter.populate(unicodes=unicodes)
+  subsetter.subset(font)
+  f = io.BytesIO()
+  subset.save_font(font, f, options)
+  return len(f.getvalue())
 
 
 def subset_range(infile :str, outfile :str, unicodeRange :str):
-  pyftsubset = pjoin(VENVDIR, 'bin/pyftsubset')
-
-  args = [
-    pyftsubset,
-    '--unicodes=' + unicodeRange,
-    '--layout-features=*',
-    '--recommended-glyphs',
-    '--no-recalc-bounds',
-    '--no-prune-unicode-ranges',
-    '--no-hinting',
-    '--output-file=' + outfile,
-    infile
-  ]
-  if outfile.endswith('.woff2'):
-    args.append('--flavor=woff2')
-
-  print("pyftsubset %s -> %s" % (relpath(infile), relpath(outfile)))
-  # print('\n  '.join([repr(a) for a in args]))  # debug
-  p = subprocess.run(
-    args,
-    shell=False,
-    stdout=subprocess.PIPE,
-    stderr=subprocess.PIPE,
-    encoding='utf-8', # py3
-  )
-  if p.returncode != 0:
-    raise Exception(
-      'pyftsubset failed:\n-- stdout:\n%s\n\n-- stderr:\n%s\n\n-- invocation:\n%s' % (
-      p.stdout.strip(),
-      p.stderr.strip(),
-      '\n  '.join([repr(a) for a in args]),
-    ))
-    # sys.exit(p.returncode)
+  # Runs in a worker process
+  options = subset_options(outfile)
+  font = load_font(infile)
+  print("subset %s -> %s" % (relpath(infile), relpath(outfile)))
+  subsetter = subset.Subsetter(options)
+  subsetter.populate(unicodes=subset.parse_unicodes(unicodeRange))
+  subsetter.subset(font)
+  subset.save_font(font, outfile, options)
   print("write", outfile)
 
+
 # (name, ...[int|range(int)]) -> { name:str codepoints:[int|range(int)] }
 def defsubset(name, *codepoints):
   return { 'name':name, 'codepoints':codepoints }
@@ -357,17 +671,23 @@ def genCompactCodepointRanges(codepoints :[int], groupAllThreshold :int) -> str:
 
 
 def genCompactIntRanges(codepoints :[int]) -> [[int]]:
+  # ranges are inclusive, as with defsubset and genUnicodeRange
   compact = []
   codepoints = sorted(codepoints)
   for k, g in groupby(enumerate(codepoints), lambda t: t[0]-t[1]):
     ilist = list(map(itemgetter(1), g))
     if len(ilist) > 1:
-      compact.append(range(ilist[0], ilist[-1]+1))
+      compact.append(range(ilist[0], ilist[-1]))
     else:
       compact.append(ilist[0])
   return compact
 
 
+def genCodepointList(codepoints :[int]) -> str:
+  _, unicodeRange = genUnicodeRange(genCompactIntRanges(codepoints))
+  return unicodeRange.replace(',', ', ')
+
+
 def genCSS(fontinfo, subsets):
   outfileTemplate = pjoin(BASEDIR, fontinfo['outfile'])
 
@@ -379,7 +699,7 @@ def genCSS(fontinfo, subsets):
     css_extra = '\n  ' + css_extra
   css = []
 
-  for subset in list(subsets) + [{ 'name':'extra' }]:
+  for subset in subsets:
     outfile = outfileTemplate.format(subset=subset['name'])
     # Read effective codepoint coverage. This may be greater than requested
     # in case of OT features. For example, the Latin subset includes some common arrow
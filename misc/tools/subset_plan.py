@@ -0,0 +1,444 @@
+#!/usr/bin/env python
+# encoding: utf8
+#
+# Plans unicode-range subsets of a font from how often its codepoints are used in text.
+# Used by "subset.py -plan <corpus>".
+#
+# A page view is modeled as PAGE_CHARS characters drawn independently from the codepoint
+# frequencies of a corpus, so that a page needs a subset with codepoints S with the
+# probability 1 - (1 - f(S))^PAGE_CHARS, where f(S) is the sum of the frequencies of the
+# codepoints of S. Printable ASCII is assumed to be needed by every page. Codepoints of
+# the font which the corpus doesn't have are given the frequency UNSEEN_FREQUENCY.
+#
+# A subset file is as large as the glyphs it has, which includes the glyphs reachable
+# from its codepoints through GSUB (its closure, which is what fontTools.subset keeps)
+# plus a fixed size of tables and headers. These sizes are estimated from the sizes of
+# glyphs' data in the glyf and gvar tables, scaled to the size of two actual subsets of
+# the font: one without any codepoints and one with all of them (see calibrate).
+#
+# The codepoints of the font are grouped into units: printable ASCII, each codepoint
+# which the corpus has and, for the rest, 128-codepoint blocks. The units are ordered
+# from most to least frequently used (by frequency per codepoint) and the plan is the
+# split of that order into consecutive subsets which minimizes the expected number of
+# bytes downloaded per page view: the sum of the subsets' sizes weighted by the
+# probability that a page needs them, plus the size of their @font-face rules in the CSS,
+# which every page view downloads.
+#
+# Glyphs reachable through GSUB, e.g. alternates of cv01-cv16 and ss01-ss08, are kept in
+# every subset with a codepoint that reaches them, so some glyphs end up in several
+# subsets. duplication reports these glyphs and dedupe_subsets moves codepoints to other
+# subsets which already have their glyphs, when that lowers the expected number of
+# bytes downloaded. Both use a ClosureGraph of the font, made once per font, to find the
+# glyphs of single codepoints quickly.
+#
+from __future__ import print_function
+import json, struct
+from collections import Counter
+from fontTools import subset
+
+
+# number of characters of a page view
+PAGE_CHARS = 2000
+
+# frequency of each codepoint which the corpus doesn't have
+UNSEEN_FREQUENCY = 1e-8
+
+# approximate size of the @font-face rule of a subset in the CSS
+CSS_RULE_BYTES = 200
+
+# codepoints every page is assumed to need (printable ASCII)
+BASE_CODEPOINTS = frozenset(range(0x20, 0x7F))
+
+# codepoints not in the corpus are grouped into blocks of 1 << BLOCK_BITS codepoints
+BLOCK_BITS = 7
+
+# gvar table header, up to the glyph variation data offsets
+GVAR_HEADER_FORMAT = '>HHHHLHHL'
+GVAR_HEADER_SIZE = struct.calcsize(GVAR_HEADER_FORMAT)
+
+
+def load_corpus(filename :str) -> Counter:
+  # Returns the number of occurrences of each codepoint in the corpus at filename, which
+  # is either a JSON list of words ordered from most to least common, such as
+  # docs/lab/words-google-10000-english-usa-no-swears.json, a JSON string, or text.
+  # Words of lists are weighted by their rank (Zipf's law) and separated by spaces.
+  with open(filename, 'r', encoding='utf-8') as f:
+    text = f.read()
+  counts = Counter()
+  if filename.endswith('.json'):
+    data = json.loads(text)
+    if isinstance(data, list):
+      for rank, word in enumerate(data):
+        weight = 1.0 / (rank + 1)
+        for c in word + ' ':
+          counts[ord(c)] += weight
+      return counts
+    text = str(data)
+  counts.update(map(ord, text))
+  return counts
+
+
+def load_corpora(filenames :[str]) -> {int:float}:
+  # Returns the frequency of each codepoint in the corpora at filenames, each weighted
+  # the same regardless of its size
+  frequencies = Counter()
+  for filename in filenames:
+    counts = load_corpus(filename)
+    total = float(sum(counts.values()))
+    for cp, n in counts.items():
+      frequencies[cp] += n / total / len(filenames)
+  return frequencies
+
+
+def page_probability(frequency :float, base :bool) -> float:
+  # probability that a page view needs any of a set of codepoints with the sum frequency
+  if base:
+    return 1.0
+  return 1.0 - (1.0 - min(frequency, 1.0)) ** PAGE_CHARS
+
+
+def glyph_sizes(font) -> {str:int}:
+  # Returns the size in bytes of each glyph's data in the glyf and gvar tables of font
+  if 'glyf' not in font:
+    raise Exception('can only plan subsets of TrueType fonts')
+  glyphOrder = font.getGlyphOrder()
+  locations = font['loca'].locations
+  sizes = [locations[i + 1] - locations[i] for i in range(len(glyphOrder))]
+  if 'gvar' in font and font.reader is not None and 'gvar' in font.reader:
+    data = font.reader['gvar']
+    _, _, _, _, _, glyphCount, flags, _ = struct.unpack(
+      GVAR_HEADER_FORMAT, data[:GVAR_HEADER_SIZE])
+    if flags & 1:
+      offsets = struct.unpack('>%dL' % (glyphCount + 1),
+        data[GVAR_HEADER_SIZE:GVAR_HEADER_SIZE + 4 * (glyphCount + 1)])
+    else:
+      offsets = [2 * v for v in struct.unpack('>%dH' % (glyphCount + 1),
+        data[GVAR_HEADER_SIZE:GVAR_HEADER_SIZE + 2 * (glyphCount + 1)])]
+    for i in range(min(glyphCount, len(sizes))):
+      sizes[i] += offsets[i + 1] - offsets[i]
+  return dict(zip(glyphOrder, sizes))
+
+
+def closure(font, options :subset.Options, unicodes) -> frozenset:
+  # Returns the names of the glyphs which fontTools.subset keeps for unicodes.
+  # Does not modify font.
+  subsetter = subset.Subsetter(options)
+  subsetter.populate(unicodes=unicodes)
+  subsetter._closure_glyphs(font)
+  return subsetter.glyphs_retained
+
+
+class ClosureGraph:
+  # The glyphs which GSUB lookups substitute each glyph of a font with, and the
+  # components of its composite glyphs. This approximates the closure which
+  # fontTools.subset computes much faster, except that the context of contextual lookups
+  # is ignored (the lookups they refer to are applied to any glyph) and that glyphs
+  # which fontTools.subset keeps when it can't tell the context apart are missing.
+
+  def __init__(self, font, options :subset.Options):
+    self.cmap = font.getBestCmap()
+    glyphOrder = font.getGlyphOrder()
+    self.substitutes = {}  # glyph => {glyph}
+    self.ligatures = {}    # first glyph => [([glyph], ligature glyph)]
+    self.components = {}   # composite glyph => {glyph}
+    if 'GSUB' in font and font['GSUB'].table.LookupList:
+      for lookup in font['GSUB'].table.LookupList.Lookup:
+        for st in lookup.SubTable:
+          self._addSubTable(lookup.LookupType, st)
+    if 'glyf' in font:
+      glyf = font['glyf']
+      for g in glyphOrder:
+        glyph = glyf[g]
+        if glyph.isComposite():
+          self.components[g] = set(c.glyphName for c in glyph.components)
+    self.baseGlyphs = set()  # glyphs kept in every subset
+    if options.notdef_glyph:
+      self.baseGlyphs.add(glyphOrder[0])
+    if options.recommended_glyphs and 'glyf' in font:
+      self.baseGlyphs.update(glyphOrder[:4])
+
+  def _addSubTable(self, lookupType, st):
+    if lookupType == 7:  # extension
+      lookupType, st = st.ExtensionLookupType, st.ExtSubTable
+    if lookupType == 1:  # single
+      for a, b in st.mapping.items():
+        self.substitutes.setdefault(a, set()).add(b)
+    elif lookupType == 2:  # multiple
+      for a, bs in st.mapping.items():
+        self.substitutes.setdefault(a, set()).update(bs)
+    elif lookupType == 3:  # alternate
+      for a, bs in st.alternates.items():
+        self.substitutes.setdefault(a, set()).update(bs)
+    elif lookupType == 4:  # ligature
+      for a, ligatures in st.ligatures.items():
+        for lig in ligatures:
+          self.ligatures.setdefault(a, []).append((lig.Component, lig.LigGlyph))
+    elif lookupType == 8:  # reverse chaining contextual single
+      for a, b in zip(st.Coverage.glyphs, st.Substitute):
+        self.substitutes.setdefault(a, set()).add(b)
+
+  def closure(self, unicodes) -> frozenset:
+    # Returns the names of the glyphs of unicodes
+    glyphs = set(self.baseGlyphs)
+    glyphs.update(self.cmap[u] for u in unicodes if u in self.cmap)
+    # GSUB, like fontTools.subset, before composite glyphs
+    stack = list(glyphs)
+    while stack:
+      while stack:
+        for b in self.substitutes.get(stack.pop(), ()):
+          if b not in glyphs:
+            glyphs.add(b)
+            stack.append(b)
+      for g in list(glyphs):
+        for components, lig in self.ligatures.get(g, ()):
+          if lig not in glyphs and all(c in glyphs for c in components):
+            glyphs.add(lig)
+            stack.append(lig)
+    stack = list(glyphs)
+    while stack:
+      for c in self.components.get(stack.pop(), ()):
+        if c not in glyphs:
+          glyphs.add(c)
+          stack.append(c)
+    return frozenset(glyphs)
+
+
+class SizeModel:
+  # Estimates the sizes of subset files of a font
+
+  def __init__(self, font, options :subset.Options):
+    self.font = font
+    self.options = options
+    self.graph = ClosureGraph(font, options)
+    self.glyphSizes = glyph_sizes(font)
+    self.baseGlyphs = closure(font, options, [])  # kept in every subset
+    self.fixedBytes = 0    # size of a subset without codepoints
+    self.bytesPerByte = 1  # subset file bytes per byte of glyph data
+
+  def calibrate(self, emptySize :int, fullSize :int):
+    # Sets the model from the sizes of subset files without any, and with all, codepoints
+    glyphBytes = self.glyphBytes(set(self.glyphSizes))
+    self.fixedBytes = emptySize
+    if glyphBytes > 0:
+      self.bytesPerByte = max(0, fullSize - emptySize) / float(glyphBytes)
+
+  def glyphBytes(self, glyphs) -> int:
+    # size of the data of glyphs, excluding glyphs that are in every subset
+    sizes = self.glyphSizes
+    return sum(sizes[g] for g in glyphs if g not in self.baseGlyphs)
+
+  def size(self, glyphs) -> float:
+    # estimated size of a subset file with glyphs
+    return self.fixedBytes + self.bytesPerByte * self.glyphBytes(glyphs)
+
+  def expectedBytes(self, glyphBytes :int, frequency :float, base :bool) -> float:
+    # expected number of bytes downloaded per page view for a subset with glyphBytes
+    # (see glyphBytes) and codepoints with the sum frequency
+    return CSS_RULE_BYTES + page_probability(frequency, base) * (
+      self.fixedBytes + self.bytesPerByte * glyphBytes)
+
+
+def plan_units(unicodes, frequencies :{int:float}) -> [dict]:
+  # Groups unicodes into units, ordered from most to least frequently used
+  base = []
+  seen = []
+  blocks = {}
+  for cp in sorted(unicodes):
+    if cp in BASE_CODEPOINTS:
+      base.append(cp)
+    elif frequencies.get(cp, 0) > 0:
+      seen.append(cp)
+    else:
+      blocks.setdefault(cp >> BLOCK_BITS, []).append(cp)
+  units = []
+  if base:
+    units.append(plan_unit(base, frequencies, True))
+  for cp in seen:
+    units.append(plan_unit([cp], frequencies, False))
+  for block in sorted(blocks):
+    units.append(plan_unit(blocks[block], frequencies, False))
+  units.sort(key=lambda u: (not u['base'], -u['frequency'] / len(u['codepoints']),
+                            u['codepoints'][0]))
+  return units
+
+
+def plan_unit(codepoints :[int], frequencies :{int:float}, base :bool) -> dict:
+  frequency = sum(frequencies.get(cp, UNSEEN_FREQUENCY) for cp in codepoints)
+  return { 'codepoints': codepoints, 'frequency': frequency, 'base': base }
+
+
+def plan_subsets(model :SizeModel, frequencies :{int:float}, unicodes) -> [dict]:
+  # Returns subsets of unicodes (see subset.defsubset) which minimize the expected
+  # number of bytes downloaded per page view
+  units = plan_units(unicodes, frequencies)
+  for unit in units:
+    unit['glyphs'] = model.graph.closure(unit['codepoints'])
+
+  # best[j] = (cost, i): the least expected bytes of units[:j], with the last subset
+  # being units[i:j]. The glyphs of a subset are taken to be the union of the glyphs of
+  # its units, which can be fewer than its closure (e.g. ligatures of codepoints of
+  # different units) but is much faster to compute.
+  n = len(units)
+  best = [(0.0, 0)] + [(float('inf'), 0)] * n
+  for i in range(n):
+    glyphs = set()
+    frequency = 0.0
+    base = False
+    for j in range(i, n):
+      unit = units[j]
+      glyphs.update(unit['glyphs'])
+      frequency += unit['frequency']
+      base = base or unit['base']
+      cost = best[i][0] + model.expectedBytes(model.glyphBytes(glyphs), frequency, base)
+      if cost < best[j + 1][0]:
+        best[j + 1] = (cost, i)
+
+  parts = []
+  j = n
+  while j > 0:
+    i = best[j][1]
+    parts.append(sorted(cp for unit in units[i:j] for cp in unit['codepoints']))
+    j = i
+  parts.reverse()
+
+  return [{ 'name': 'plan%d' % (i + 1), 'codepoints': compact_ranges(codepoints) }
+          for i, codepoints in enumerate(parts)]
+
+
+def dedupe_subsets(model :SizeModel, frequencies :{int:float},
+                   parts :[(str, [int])]) -> [dict]:
+  # Moves codepoints of subsets with codepoints, a list of (name, codepoints), to other
+  # subsets which already have some of their glyphs, when that lowers the expected
+  # number of bytes downloaded per page view. Returns the resulting subsets (see
+  # subset.defsubset), without subsets which have no codepoints left.
+  graph = model.graph
+  sizes = model.glyphSizes
+  baseGlyphs = model.baseGlyphs
+  names = [name for name, _ in parts]
+  codepoints = [set(cps) for _, cps in parts]
+  glyphs = {}  # codepoint => glyphs, excluding glyphs that are in every subset
+  for cps in codepoints:
+    for cp in cps:
+      glyphs[cp] = [g for g in graph.closure([cp]) if g not in baseGlyphs]
+
+  # state of each subset: number of its codepoints having each glyph, size of its glyphs,
+  # sum frequency and number of BASE_CODEPOINTS
+  refs = [Counter() for _ in parts]
+  glyphBytes = [0] * len(parts)
+  frequency = [0.0] * len(parts)
+  baseCount = [0] * len(parts)
+  owners = {}  # glyph => indices of subsets with the glyph
+  def update(i, cp, d):
+    for g in glyphs[cp]:
+      n = refs[i][g] + d
+      refs[i][g] = n
+      if n == 0:
+        glyphBytes[i] -= sizes[g]
+        owners[g].discard(i)
+      elif n == 1 and d > 0:
+        glyphBytes[i] += sizes[g]
+        owners.setdefault(g, set()).add(i)
+    frequency[i] += d * frequencies.get(cp, UNSEEN_FREQUENCY)
+    baseCount[i] += d * (cp in BASE_CODEPOINTS)
+  for i, cps in enumerate(codepoints):
+    for cp in cps:
+      update(i, cp, 1)
+
+  def cost(i, dBytes, dFrequency, dBase, dCount):
+    if len(codepoints[i]) + dCount == 0:
+      return 0.0
+    return model.expectedBytes(
+      glyphBytes[i] + dBytes, frequency[i] + dFrequency, baseCount[i] + dBase > 0)
+
+  for _ in range(10):
+    improved = False
+    for b in range(len(parts)):
+      for cp in sorted(codepoints[b]):
+        f = frequencies.get(cp, UNSEEN_FREQUENCY)
+        isBase = int(cp in BASE_CODEPOINTS)
+        targets = set()
+        for g in glyphs[cp]:
+          targets.update(owners[g])
+        targets.discard(b)
+        if not targets:
+          continue
+        removed = sum(sizes[g] for g in glyphs[cp] if refs[b][g] == 1)
+        costB = cost(b, -removed, -f, -isBase, -1) - cost(b, 0, 0, 0, 0)
+        best, bestDelta = None, -0.5
+        for a in sorted(targets):
+          added = sum(sizes[g] for g in glyphs[cp] if refs[a][g] == 0)
+          delta = costB + cost(a, added, f, isBase, 1) - cost(a, 0, 0, 0, 0)
+          if delta < bestDelta:
+            best, bestDelta = a, delta
+        if best is not None:
+          update(b, cp, -1)
+          codepoints[b].discard(cp)
+          update(best, cp, 1)
+          codepoints[best].add(cp)
+          improved = True
+    if not improved:
+      break
+
+  return [{ 'name': name, 'codepoints': compact_ranges(cps) }
+          for name, cps in zip(names, codepoints) if cps]
+
+
+def evaluate(model :SizeModel, frequencies :{int:float}, parts :[(str, [int])]) -> [dict]:
+  # Returns estimates for subsets with codepoints, a list of (name, codepoints)
+  stats = []
+  for name, codepoints in parts:
+    glyphs = closure(model.font, model.options, codepoints)
+    frequency = sum(frequencies.get(cp, UNSEEN_FREQUENCY) for cp in codepoints)
+    base = any(cp in BASE_CODEPOINTS for cp in codepoints)
+    stats.append({
+      'name': name,
+      'codepoints': len(codepoints),
+      'glyphs': len(glyphs),
+      'probability': page_probability(frequency, base),
+      'bytes': model.size(glyphs),
+    })
+  return stats
+
+
+def duplication(model :SizeModel, parts :[(str, [int])]) -> [dict]:
+  # Returns the glyphs of each of subsets with codepoints, a list of (name, codepoints),
+  # which other subsets have too, with their estimated size in the subset file
+  closures = [closure(model.font, model.options, cps) for _, cps in parts]
+  owners = Counter()
+  for glyphs in closures:
+    owners.update(g for g in glyphs if g not in model.baseGlyphs)
+  stats = []
+  for (name, _), glyphs in zip(parts, closures):
+    shared = set(g for g in glyphs if owners[g] > 1 and g not in model.baseGlyphs)
+    stats.append({
+      'name': name,
+      'glyphs': len(glyphs),
+      'shared': len(shared),
+      'sharedBytes': model.bytesPerByte * model.glyphBytes(shared),
+      'sharedWith': [other for (other, _), glyphs2 in zip(parts, closures)
+                     if other != name and not shared.isdisjoint(glyphs2)],
+    })
+  return stats
+
+
+def expected_bytes(stats :[dict]) -> float:
+  # expected number of bytes downloaded per page view, for stats from evaluate
+  return sum(CSS_RULE_BYTES + s['probability'] * s['bytes'] for s in stats)
+
+
+def compact_ranges(codepoints :[int]) -> [int]:
+  # Returns sorted codepoints with runs as ranges, inclusive as with subset.defsubset
+  # (i.e. range(first, last) for codepoints first...last)
+  compact = []
+  codepoints = sorted(codepoints)
+  start = 0
+  while start < len(codepoints):
+    end = start
+    while end + 1 < len(codepoints) and codepoints[end + 1] == codepoints[end] + 1:
+      end += 1
+    if end > start:
+      compact.append(range(codepoints[start], codepoints[end]))
+    else:
+      compact.append(codepoints[start])
+    start = end + 1
+  return compact